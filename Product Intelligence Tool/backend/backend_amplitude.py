@@ -1,7 +1,18 @@
+import gzip
 import httpx
+import json
+import tempfile
+import zipfile
 from datetime import datetime
-from typing import List, Dict
-import hashlib
+from typing import AsyncIterator, List, Dict
+
+from transport import get_http_client
+from integrations.hashing import user_id_hasher
+from integrations.ratelimit import get_limiter
+from batch import EventBatch
+
+# Exports larger than this spill from memory to a temp file on disk
+SPOOL_MAX_MEMORY = 32 * 1024 * 1024
 
 class AmplitudeClient:
     def __init__(self, api_key: str, api_secret: str):
@@ -11,49 +22,77 @@ class AmplitudeClient:
     
     async def fetch_events(self, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Fetch events from Amplitude Export API"""
-        events = []
+        events = EventBatch()
+        async for batch in self.stream_events(start_date, end_date):
+            events.extend(batch)
+        return events.to_events()
+    
+    async def stream_events(
+        self, start_date: datetime, end_date: datetime, batch_size: int = 5000
+    ) -> AsyncIterator[EventBatch]:
+        """Spool the export archive to disk and yield normalized events in batches"""
+        client = get_http_client()
+        params = {
+            "start": start_date.strftime("%Y%m%dT%H"),
+            "end": end_date.strftime("%Y%m%dT%H")
+        }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            params = {
-                "start": start_date.strftime("%Y%m%dT%H"),
-                "end": end_date.strftime("%Y%m%dT%H")
-            }
-            
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as spool:
             try:
-                response = await client.get(
+                async with get_limiter("amplitude").stream(
+                    client,
+                    "GET",
                     f"{self.base_url}/export",
                     params=params,
                     auth=(self.api_key, self.api_secret)
-                )
-                response.raise_for_status()
-                
-                # Amplitude returns ZIP with JSONL
-                import zipfile
-                import io
-                import json
-                
-                with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
-                    for filename in zf.namelist():
-                        with zf.open(filename) as f:
-                            for line in f:
-                                if not line.strip():
-                                    continue
-                                
-                                event_data = json.loads(line)
-                                
-                                normalized = {
-                                    "user_id": self._hash_user_id(event_data.get("user_id", "")),
-                                    "session_id": str(event_data.get("session_id")),
-                                    "event_name": event_data["event_type"],
-                                    "timestamp": datetime.fromtimestamp(event_data["event_time"] / 1000),
-                                    "properties": event_data.get("event_properties", {})
-                                }
-                                events.append(normalized)
-                
-            except Exception as e:
-                print(f"Amplitude fetch error: {e}")
-        
-        return events
+                ) as response:
+                    async for chunk in response.aiter_bytes():
+                        spool.write(chunk)
+            except httpx.HTTPStatusError as e:
+                # The export API answers 404 when the range has no data
+                if e.response.status_code == 404:
+                    return
+                raise
+            
+            spool.seek(0)
+            
+            # Amplitude returns a ZIP of gzipped JSONL files
+            with zipfile.ZipFile(spool) as zf:
+                for member in zf.infolist():
+                    if member.is_dir():
+                        continue
+                    
+                    with zf.open(member) as raw:
+                        f = gzip.GzipFile(fileobj=raw) if member.filename.endswith(".gz") else raw
+                        raw_events = []
+                        for line in f:
+                            if not line.strip():
+                                continue
+                            
+                            raw_events.append(json.loads(line))
+                            if len(raw_events) >= batch_size:
+                                yield self.normalize_batch(raw_events)
+                                raw_events = []
+                        
+                        if raw_events:
+                            yield self.normalize_batch(raw_events)
     
-    def _hash_user_id(self, user_id: str) -> str:
-        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
\ No newline at end of file
+    @classmethod
+    def normalize_batch(cls, raw_events: List[Dict]) -> EventBatch:
+        """Normalize a page of export records column by column, hashing its user ids in one pass.
+        
+        Needs no credentials, so the offline importer reuses it on export files.
+        Anonymous events carry no user_id; their device_id stands in for it.
+        """
+        identified = [e for e in raw_events if e.get("user_id") or e.get("device_id")]
+        if len(identified) < len(raw_events):
+            print(f"Skipped {len(raw_events) - len(identified)} Amplitude events without a user_id or device_id")
+            raw_events = identified
+        
+        return EventBatch(
+            user_id=user_id_hasher.hash_many(str(e.get("user_id") or e["device_id"]) for e in raw_events),
+            session_id=[str(e.get("session_id")) for e in raw_events],
+            event_name=[e["event_type"] for e in raw_events],
+            timestamp=[datetime.fromtimestamp(e["event_time"] / 1000) for e in raw_events],
+            properties=[e.get("event_properties", {}) for e in raw_events]
+        )
\ No newline at end of file
@@ -0,0 +1,165 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, SyncState
+from batch import naive_utc
+from sync import ingestion_tracker
+from writer import BulkEventWriter, event_batches
+
+SHARD_SIZES = {
+    "day": timedelta(days=1),
+    "hour": timedelta(hours=1)
+}
+
+def plan_shards(start_date: datetime, end_date: datetime, granularity: str = "day") -> List[Tuple[datetime, datetime]]:
+    """Split [start_date, end_date) into shards aligned to day or hour boundaries.
+    
+    Aligned boundaries keep shard keys stable between runs, so a restarted
+    backfill recognises the shards it already finished.
+    """
+    step = SHARD_SIZES[granularity]
+    if granularity == "day":
+        cursor = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        cursor = start_date.replace(minute=0, second=0, microsecond=0)
+    
+    shards = []
+    while cursor < end_date:
+        shards.append((cursor, min(cursor + step, end_date)))
+        cursor += step
+    return shards
+
+def shard_key(shard: Tuple[datetime, datetime]) -> str:
+    return f"{shard[0].isoformat()}/{shard[1].isoformat()}"
+
+def _parse_range(completed) -> Tuple[datetime, datetime]:
+    # Checkpoints from before ranges were stored hold one "start/end" shard key each
+    start, end = completed.split("/") if isinstance(completed, str) else completed
+    return datetime.fromisoformat(start), datetime.fromisoformat(end)
+
+def add_completed(completed: List, shard: Tuple[datetime, datetime]) -> List[List[str]]:
+    """Merge a finished shard into the checkpoint's sorted, disjoint [start, end] ranges.
+    
+    Workers finish shards roughly in order, so the list stays a handful of
+    ranges however many shards a backfill has.
+    """
+    merged: List[List[datetime]] = []
+    for start, end in sorted([_parse_range(c) for c in completed] + [shard]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [[start.isoformat(), end.isoformat()] for start, end in merged]
+
+def is_completed(completed: List, shard: Tuple[datetime, datetime]) -> bool:
+    return any(start <= shard[0] and shard[1] <= end for start, end in map(_parse_range, completed))
+
+async def _run_shard(client, source: str, shard: Tuple[datetime, datetime]) -> Dict:
+    """Load one shard and checkpoint it in the same transaction as its rows"""
+    shard_start, shard_end = shard
+    
+    async with AsyncSessionLocal() as db:
+        writer = BulkEventWriter(db, source)
+        
+        # Vendor APIs treat the end as inclusive (whole days for Mixpanel/Heap,
+        # whole hours for Amplitude), so ask for just under the shard end and
+        # drop anything outside [shard_start, shard_end) to keep shards disjoint.
+        async for batch in event_batches(client, shard_start, shard_end - timedelta(microseconds=1)):
+            await writer.write(batch.between(shard_start, shard_end))
+        stats = await writer.close()
+        
+        result = await db.execute(
+            select(SyncState).where(SyncState.source == source).with_for_update()
+        )
+        sync_state = result.scalar_one()
+        metadata = dict(sync_state.metadata or {})
+        backfill = dict(metadata.get("backfill") or {})
+        backfill["completed"] = add_completed(backfill.get("completed", []), shard)
+        metadata["backfill"] = backfill
+        sync_state.metadata = metadata
+        
+        await db.commit()
+        return stats
+
+async def run_backfill(
+    client,
+    source: str,
+    start_date: datetime,
+    end_date: datetime,
+    granularity: str = "day",
+    workers: int = 4,
+    restart: bool = False
+) -> Dict:
+    """Backfill a source shard by shard, skipping shards checkpointed by earlier runs.
+    
+    Hour shards only pay off for sources that export by the hour (Amplitude,
+    PostHog); day-granular APIs would fetch the same day once per hour.
+    """
+    start_date, end_date = naive_utc(start_date), naive_utc(end_date)
+    shards = plan_shards(start_date, end_date, granularity)
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SyncState).where(SyncState.source == source))
+        sync_state = result.scalar_one_or_none()
+        if sync_state is None:
+            sync_state = SyncState(source=source, status="backfilling", metadata={})
+            db.add(sync_state)
+        
+        metadata = dict(sync_state.metadata or {})
+        if restart:
+            metadata.pop("backfill", None)
+        completed = (metadata.get("backfill") or {}).get("completed", [])
+        metadata["backfill"] = {
+            "start": start_date.isoformat(),
+            "end": end_date.isoformat(),
+            "granularity": granularity,
+            "completed": completed
+        }
+        sync_state.metadata = metadata
+        sync_state.status = "backfilling"
+        await db.commit()
+    
+    pending = [shard for shard in shards if not is_completed(completed, shard)]
+    semaphore = asyncio.Semaphore(workers)
+    
+    async def worker(shard):
+        with ingestion_tracker.track():
+            async with semaphore:
+                return await _run_shard(client, source, shard)
+    
+    outcomes = await asyncio.gather(*[worker(shard) for shard in pending], return_exceptions=True)
+    
+    failed = []
+    rows = 0
+    skipped = 0
+    for shard, outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Backfill shard {shard_key(shard)} for {source} failed: {outcome}")
+            failed.append(shard_key(shard))
+        else:
+            rows += outcome["rows"]
+            skipped += outcome["skipped"]
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SyncState).where(SyncState.source == source))
+        sync_state = result.scalar_one()
+        if failed:
+            sync_state.status = "partial"
+        else:
+            sync_state.status = "success"
+            if sync_state.last_sync is None or sync_state.last_sync < end_date:
+                sync_state.last_sync = end_date
+        await db.commit()
+    
+    return {
+        "status": "partial" if failed else "success",
+        "shards_total": len(shards),
+        "shards_skipped": len(shards) - len(pending),
+        "shards_loaded": len(pending) - len(failed),
+        "shards_failed": failed,
+        "events_ingested": rows,
+        "events_skipped": skipped
+    }
\ No newline at end of file
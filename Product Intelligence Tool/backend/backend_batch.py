@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence
+
+COLUMNS = ("user_id", "session_id", "event_name", "timestamp", "properties")
+
+# Per source, properties holding an aggregated row's weight (GA4 eventCount) rather
+# than part of its identity; a re-sync updates them in place instead of adding a row.
+# Other sources' properties are identity whatever they are called.
+WEIGHT_PROPERTIES = {"ga4": ("event_count",)}
+
+def naive_utc(ts: datetime) -> datetime:
+    """Store timestamps as naive UTC, matching the events.timestamp column"""
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+def event_dedup_key(source: str, user_id: str, event_name: str, timestamp: datetime, properties_json: str) -> str:
+    """Deterministic identity of an event, stable across overlapping syncs and retries"""
+    raw = "\x1f".join([
+        source,
+        str(user_id),
+        str(event_name),
+        timestamp.isoformat() if timestamp is not None else "",
+        properties_json
+    ])
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+def identity_json(source: str, properties: Dict, properties_json: str, session_id) -> str:
+    """The properties part of a dedup key: weights are left out, so aggregated rows are keyed by session"""
+    weights = WEIGHT_PROPERTIES.get(source, ())
+    if not any(key in properties for key in weights):
+        return properties_json
+    identity = {key: value for key, value in properties.items() if key not in weights}
+    return json.dumps([identity, session_id], sort_keys=True, default=str)
+
+class EventBatch:
+    """Normalized events as parallel column lists.
+    
+    Connectors fill the columns directly instead of building one dict per
+    event, and the writer turns them into COPY records in a single zip. The
+    source is not a column: every batch belongs to the source it is written
+    for, and the writer adds it.
+    """
+    
+    __slots__ = COLUMNS
+    
+    def __init__(
+        self,
+        user_id: Optional[List[str]] = None,
+        session_id: Optional[List[Optional[str]]] = None,
+        event_name: Optional[List[str]] = None,
+        timestamp: Optional[List[datetime]] = None,
+        properties: Optional[List[Dict]] = None
+    ):
+        self.user_id = user_id if user_id is not None else []
+        self.session_id = session_id if session_id is not None else [None] * len(self.user_id)
+        self.event_name = event_name if event_name is not None else []
+        self.timestamp = timestamp if timestamp is not None else []
+        self.properties = properties if properties is not None else [{} for _ in self.user_id]
+    
+    def __len__(self) -> int:
+        return len(self.user_id)
+    
+    @classmethod
+    def from_events(cls, events: Iterable[Dict]) -> "EventBatch":
+        """Build a batch from normalized event dicts (pushed events, older connectors)"""
+        batch = cls()
+        for e in events:
+            batch.append(e.get("user_id"), e.get("session_id"), e.get("event_name"), e.get("timestamp"), e.get("properties"))
+        return batch
+    
+    def append(self, user_id: str, session_id: Optional[str], event_name: str, timestamp: datetime, properties: Optional[Dict]):
+        self.user_id.append(user_id)
+        self.session_id.append(session_id)
+        self.event_name.append(event_name)
+        self.timestamp.append(timestamp)
+        self.properties.append(properties or {})
+    
+    def extend(self, other: "EventBatch"):
+        for column in COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+    
+    def take(self, indices: Sequence[int]) -> "EventBatch":
+        return EventBatch(*[[getattr(self, column)[i] for i in indices] for column in COLUMNS])
+    
+    def slice(self, start: int, stop: int) -> "EventBatch":
+        return EventBatch(*[getattr(self, column)[start:stop] for column in COLUMNS])
+    
+    def between(self, start: datetime, end: datetime) -> "EventBatch":
+        """Events with start <= timestamp < end (naive UTC)"""
+        keep = [i for i, ts in enumerate(self.timestamp) if start <= naive_utc(ts) < end]
+        if len(keep) == len(self):
+            return self
+        return self.take(keep)
+    
+    def latest_timestamp(self) -> Optional[datetime]:
+        timestamps = [naive_utc(ts) for ts in self.timestamp if ts is not None]
+        return max(timestamps) if timestamps else None
+    
+    def to_events(self) -> List[Dict]:
+        """Row-wise dicts, for callers of the list-returning fetch_events API"""
+        return [dict(zip(COLUMNS, row)) for row in zip(*[getattr(self, column) for column in COLUMNS])]
+    
+    def to_arrow(self):
+        """pyarrow RecordBatch view of the batch (requires pyarrow)"""
+        import pyarrow as pa
+        return pa.record_batch({
+            "user_id": pa.array(self.user_id, pa.string()),
+            "session_id": pa.array(self.session_id, pa.string()),
+            "event_name": pa.array(self.event_name, pa.string()),
+            "timestamp": pa.array([naive_utc(ts) for ts in self.timestamp], pa.timestamp("us")),
+            "properties": pa.array([json.dumps(p, default=str) for p in self.properties], pa.string())
+        })
+
+class PropertyFilter:
+    """Drop vendor-internal keys from property dicts, deciding per distinct key set.
+    
+    Events from one vendor share a handful of key layouts, so which keys to
+    keep is worked out once per layout and reused, instead of testing every
+    key of every event.
+    """
+    
+    def __init__(self, drop_prefix: str = "$", drop_keys: Iterable[str] = (), max_layouts: int = 4096):
+        self.drop_prefix = drop_prefix
+        self.drop_keys = frozenset(drop_keys)
+        self.max_layouts = max_layouts
+        self._layouts: Dict[tuple, tuple] = {}
+    
+    def _keep(self, keys: tuple) -> tuple:
+        keep = self._layouts.get(keys)
+        if keep is None:
+            keep = tuple(k for k in keys if not k.startswith(self.drop_prefix) and k not in self.drop_keys)
+            if len(self._layouts) >= self.max_layouts:
+                self._layouts.clear()
+            self._layouts[keys] = keep
+        return keep
+    
+    def __call__(self, properties: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        out = []
+        for props in properties:
+            keys = tuple(props)
+            keep = self._keep(keys)
+            out.append(props if len(keep) == len(keys) else {k: props[k] for k in keep})
+        return out
+
+async def merge_pages(producers: Iterable[AsyncIterator[EventBatch]], concurrency: int) -> AsyncIterator[EventBatch]:
+    """Run page iterators (one per time slice, say) at most `concurrency` at a time, yielding pages as they land.
+    
+    Pages wait in a queue bounded at twice the concurrency, so a slow writer
+    holds the fetches back. An iterator that fails cancels the others and
+    its error is raised to the caller.
+    """
+    pages: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def drain(producer: AsyncIterator[EventBatch]):
+        async with semaphore:
+            async for page in producer:
+                await pages.put(page)
+    
+    async def drain_all():
+        tasks = [asyncio.create_task(drain(producer)) for producer in producers]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(e, asyncio.CancelledError):
+                await pages.put(None)
+            raise
+        await pages.put(None)
+    
+    producer = asyncio.create_task(drain_all())
+    try:
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            yield page
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
\ No newline at end of file
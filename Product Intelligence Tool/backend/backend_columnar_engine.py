@@ -0,0 +1,177 @@
+import asyncio
+import glob
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import text
+
+from database import engine as db_engine
+from engines.metrics import MetricsEngine
+from rollup import ROLLUP_TABLE
+
+# "postgres" computes metrics from the rollup table; "duckdb" from the Parquet mirror of events
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "postgres")
+ANALYTICS_PARQUET_DIR = os.getenv("ANALYTICS_PARQUET_DIR", "./analytics")
+# Rows fetched from Postgres and written per Parquet row group
+ANALYTICS_EXPORT_BATCH = int(os.getenv("ANALYTICS_EXPORT_BATCH", "100000"))
+
+# Furthest back any MetricsEngine metric reads (MAU, the retention cohort)
+METRIC_WINDOW_DAYS = 30
+
+EVENTS_DIR = os.path.join(ANALYTICS_PARQUET_DIR, "events")
+MANIFEST_PATH = os.path.join(ANALYTICS_PARQUET_DIR, "manifest.json")
+
+def _day_path(day: date) -> str:
+    # Hive-style directories, so DuckDB prunes files on the day column
+    return os.path.join(EVENTS_DIR, f"day={day.isoformat()}", "events.parquet")
+
+def _load_manifest() -> Dict[str, int]:
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def _save_manifest(manifest: Dict[str, int]):
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+async def _export_day(conn, day: date, path: str) -> int:
+    """Stream one day of events into a Parquet file; returns the rows written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([("user_id", pa.int64()), ("event_name_id", pa.int32()), ("timestamp", pa.timestamp("us"))])
+    start = datetime.combine(day, datetime.min.time())
+    result = await conn.stream(
+        text("SELECT user_id, event_name_id, timestamp FROM events WHERE timestamp >= :start AND timestamp < :end"),
+        {"start": start, "end": start + timedelta(days=1)}
+    )
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        async for partition in result.partitions(ANALYTICS_EXPORT_BATCH):
+            user_ids, event_name_ids, timestamps = zip(*partition)
+            table = pa.table([list(user_ids), list(event_name_ids), list(timestamps)], schema=schema)
+            await asyncio.to_thread(writer.write_table, table)
+            rows += len(partition)
+    return rows
+
+async def sync_parquet_mirror(days: int = METRIC_WINDOW_DAYS) -> Dict:
+    """Re-export each of the last `days` days whose event total in the rollup changed since its last export.
+    
+    Each day is read in one repeatable-read snapshot, so its file and the
+    rollup total it is checked against always agree. A day whose raw events
+    were already pruned by compaction can't be exported completely; its
+    existing file (if any) is kept and the day is reported as incomplete.
+    """
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    manifest = _load_manifest()
+    since = datetime.utcnow().date() - timedelta(days=days)
+    
+    async with db_engine.connect() as conn:
+        result = await conn.execute(
+            text(f"SELECT day, sum(event_count) FROM {ROLLUP_TABLE} WHERE day >= :since GROUP BY day ORDER BY day"),
+            {"since": since}
+        )
+        totals = {day: int(total) for day, total in result.all()}
+    
+    exported, incomplete = [], []
+    for day, total in totals.items():
+        if manifest.get(day.isoformat()) == total:
+            continue
+        
+        path = _day_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        async with db_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+            async with conn.begin():
+                total = int(await conn.scalar(
+                    text(f"SELECT coalesce(sum(event_count), 0) FROM {ROLLUP_TABLE} WHERE day = :day"), {"day": day}
+                ))
+                rows = await _export_day(conn, day, tmp)
+        
+        if rows != total:
+            os.remove(tmp)
+            incomplete.append(day.isoformat())
+            continue
+        os.replace(tmp, path)
+        manifest[day.isoformat()] = total
+        exported.append(day.isoformat())
+    
+    if exported:
+        _save_manifest(manifest)
+    return {"days_exported": exported, "days_incomplete": incomplete}
+
+class ColumnarMetricsEngine(MetricsEngine):
+    """MetricsEngine running its queries with DuckDB over the Parquet mirror.
+    
+    Only the query methods are replaced; the metric definitions and writes
+    are shared, so both backends store identical metrics as long as the
+    mirror is in sync (see sync_parquet_mirror). A range touching one of
+    `incomplete_days` (the mirror's is missing or stale) is queried on the
+    rollup instead. Requires duckdb and pyarrow.
+    """
+    
+    def __init__(self, db, incomplete_days: Iterable[date] = ()):
+        super().__init__(db)
+        self.incomplete_days = set(incomplete_days)
+    
+    def _mirrored(self, start: date, end: date) -> bool:
+        return not any(start <= day < end for day in self.incomplete_days)
+    
+    def _source(self) -> str:
+        pattern = os.path.join(EVENTS_DIR, "*", "*.parquet").replace("'", "''")
+        return f"read_parquet('{pattern}', hive_partitioning = true, hive_types = {{'day': DATE}})"
+    
+    def _run(self, sql: str, params: List) -> List[tuple]:
+        import duckdb
+        
+        if not glob.glob(os.path.join(EVENTS_DIR, "*", "*.parquet")):
+            return []
+        with duckdb.connect() as con:
+            return con.execute(sql.format(events=self._source()), params).fetchall()
+    
+    async def _query(self, sql: str, *params) -> List[tuple]:
+        # DuckDB calls block, so they run off the event loop like other sync clients
+        return await asyncio.to_thread(self._run, sql, list(params))
+    
+    async def _active_users(self, start: date, end: date) -> int:
+        if not self._mirrored(start, end):
+            return await super()._active_users(start, end)
+        rows = await self._query(
+            "SELECT count(DISTINCT user_id) FROM {events} WHERE day >= ? AND day < ?", start, end
+        )
+        return rows[0][0] if rows else 0
+    
+    async def _retained_users(self, cohort_day: date, day: date) -> int:
+        if cohort_day in self.incomplete_days or day in self.incomplete_days:
+            return await super()._retained_users(cohort_day, day)
+        rows = await self._query(
+            "SELECT count(DISTINCT user_id) FROM {events} "
+            "WHERE day = ? AND user_id IN (SELECT user_id FROM {events} WHERE day = ?)",
+            day, cohort_day
+        )
+        return rows[0][0] if rows else 0
+    
+    async def _users_per_event(self, start: date, end: date) -> Dict[int, int]:
+        if not self._mirrored(start, end):
+            return await super()._users_per_event(start, end)
+        rows = await self._query(
+            "SELECT event_name_id, count(DISTINCT user_id) FROM {events} "
+            "WHERE day >= ? AND day < ? GROUP BY event_name_id",
+            start, end
+        )
+        return dict(rows)
+    
+    async def _event_users(self, event_name_id: int, start: date, end: date) -> Set[int]:
+        if not self._mirrored(start, end):
+            return await super()._event_users(event_name_id, start, end)
+        rows = await self._query(
+            "SELECT DISTINCT user_id FROM {events} WHERE event_name_id = ? AND day >= ? AND day < ?",
+            event_name_id, start, end
+        )
+        return {row[0] for row in rows}
\ No newline at end of file
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import select, text
+
+from database import engine, AsyncSessionLocal, SyncState
+from event_queue import event_queue
+from partitions import EVENTS_TABLE, EVENTS_RETENTION_MODE, list_partitions, remove_partition
+from rollup import COMPACTION_STATE, rebuild_rollup
+from sync import ingestion_tracker
+from sync_jobs import sync_jobs
+
+# Raw events older than this many days are rolled up and pruned; 0 disables compaction
+EVENTS_COMPACT_AFTER_DAYS = int(os.getenv("EVENTS_COMPACT_AFTER_DAYS", "0"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "10000"))
+# Pause between delete batches, and between checks while ingestion is busy
+COMPACTION_PAUSE_SECONDS = float(os.getenv("COMPACTION_PAUSE_SECONDS", "0.5"))
+
+async def _table_bytes(conn, table: str) -> int:
+    """Total on-disk size of a table with its indexes (and partitions, for the parent)"""
+    return await conn.scalar(text(
+        "SELECT CAST(coalesce(sum(pg_total_relation_size(relid)), 0) AS bigint) FROM pg_partition_tree(CAST(:name AS regclass))"
+    ), {"name": table})
+
+def _ingestion_busy() -> bool:
+    """True while pushed events are backing up, a sync or backfill runs, or the pool is exhausted"""
+    if event_queue.depth >= event_queue.max_events // 2:
+        return True
+    if ingestion_tracker.in_flight or any(not job.done for job in sync_jobs.list()):
+        return True
+    return engine.pool.checkedout() >= engine.pool.size()
+
+async def _yield_to_ingestion():
+    await asyncio.sleep(COMPACTION_PAUSE_SECONDS)
+    while _ingestion_busy():
+        await asyncio.sleep(COMPACTION_PAUSE_SECONDS)
+
+async def _load_state(db) -> SyncState:
+    result = await db.execute(select(SyncState).where(SyncState.source == COMPACTION_STATE).with_for_update())
+    state = result.scalar_one_or_none()
+    if state is None:
+        state = SyncState(source=COMPACTION_STATE, status="idle", metadata={})
+        db.add(state)
+    return state
+
+async def _roll_up_days(cutoff: date) -> int:
+    """Rebuild the rollup of each day before cutoff still held as raw events, once per day.
+    
+    The watermark advances in the same transaction as each rebuild, so a day
+    whose raw rows are already partly pruned is never rebuilt from them.
+    """
+    async with engine.connect() as conn:
+        oldest = await conn.scalar(
+            text(f"SELECT min(timestamp) FROM {EVENTS_TABLE} WHERE timestamp < :cutoff"),
+            {"cutoff": datetime.combine(cutoff, datetime.min.time())}
+        )
+    if oldest is None:
+        return 0
+    
+    days = 0
+    async with AsyncSessionLocal() as db:
+        state = await _load_state(db)
+        watermark = (state.metadata or {}).get("rolled_up_through")
+        await db.commit()
+        
+        day = max(oldest.date(), date.fromisoformat(watermark)) if watermark else oldest.date()
+        while day < cutoff:
+            state = await _load_state(db)
+            await rebuild_rollup(await db.connection(), day, day + timedelta(days=1))
+            state.metadata = {**(state.metadata or {}), "rolled_up_through": (day + timedelta(days=1)).isoformat()}
+            await db.commit()
+            days += 1
+            day += timedelta(days=1)
+            await _yield_to_ingestion()
+    return days
+
+async def _drop_expired_partitions(cutoff: date) -> Dict:
+    """Drop (or detach, per EVENTS_RETENTION_MODE) whole partitions that end before cutoff; far cheaper than deleting their rows"""
+    dropped, reclaimed = [], 0
+    async with engine.begin() as conn:
+        for partition in await list_partitions(conn):
+            if partition["end"].date() > cutoff:
+                continue
+            reclaimed += await _table_bytes(conn, partition["name"])
+            await remove_partition(conn, partition["name"], EVENTS_RETENTION_MODE)
+            dropped.append(partition["name"])
+    return {"partitions": dropped, "bytes": reclaimed}
+
+async def _delete_in_batches(cutoff: date) -> int:
+    """Delete remaining raw rows before cutoff, one short transaction per batch"""
+    deleted = 0
+    cutoff_ts = datetime.combine(cutoff, datetime.min.time())
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(
+                f"DELETE FROM {EVENTS_TABLE} WHERE (id, timestamp) IN ("
+                f"SELECT id, timestamp FROM {EVENTS_TABLE} WHERE timestamp < :cutoff "
+                f"ORDER BY timestamp LIMIT :batch)"
+            ), {"cutoff": cutoff_ts, "batch": COMPACTION_BATCH_SIZE})
+        deleted += result.rowcount
+        if result.rowcount < COMPACTION_BATCH_SIZE:
+            return deleted
+        await _yield_to_ingestion()
+
+async def compact_events(compact_after_days: int = EVENTS_COMPACT_AFTER_DAYS, now: Optional[datetime] = None) -> Optional[Dict]:
+    """Roll up and prune raw events older than compact_after_days; returns run stats.
+    
+    Bytes reclaimed are exact for dropped partitions. Deleted rows only free
+    space for reuse once vacuumed, so the table keeps its file size; their
+    share is estimated from the average row size before the run.
+    """
+    if compact_after_days <= 0:
+        return None
+    
+    started = time.monotonic()
+    cutoff = (now or datetime.utcnow()).date() - timedelta(days=compact_after_days)
+    
+    async with engine.connect() as conn:
+        bytes_before = await _table_bytes(conn, EVENTS_TABLE)
+        rows_before = await conn.scalar(text(
+            "SELECT CAST(coalesce(sum(greatest(c.reltuples, 0)), 0) AS float8) FROM pg_partition_tree(CAST(:name AS regclass)) t "
+            "JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf"
+        ), {"name": EVENTS_TABLE})
+    
+    days = await _roll_up_days(cutoff)
+    dropped = await _drop_expired_partitions(cutoff)
+    deleted = await _delete_in_batches(cutoff)
+    
+    row_bytes = bytes_before / rows_before if rows_before > 0 else 0
+    stats = {
+        "cutoff": cutoff.isoformat(),
+        "days_rolled_up": days,
+        "partitions_dropped": dropped["partitions"],
+        "rows_deleted": deleted,
+        "bytes_reclaimed": dropped["bytes"],
+        "bytes_freed_estimate": int(deleted * row_bytes),
+        "seconds": round(time.monotonic() - started, 1),
+        "finished_at": datetime.utcnow().isoformat()
+    }
+    
+    async with AsyncSessionLocal() as db:
+        state = await _load_state(db)
+        state.status = "success"
+        state.last_sync = datetime.utcnow()
+        state.metadata = {**(state.metadata or {}), "last_run": stats}
+        await db.commit()
+    return stats
\ No newline at end of file
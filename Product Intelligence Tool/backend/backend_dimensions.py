@@ -0,0 +1,114 @@
+import os
+from typing import Dict, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from database import engine, User, EventName, Source
+
+DIMENSION_CACHE_SIZE = int(os.getenv("DIMENSION_CACHE_SIZE", "500000"))
+# Values per INSERT/SELECT round trip, well under asyncpg's bind parameter limit
+DIMENSION_RESOLVE_CHUNK = 5000
+
+class DimensionCache:
+    """Map dimension values (user ids, event names, sources) to integer surrogate keys.
+    
+    Unknown values are inserted in batch with ON CONFLICT DO NOTHING and read
+    back, on a short transaction of their own so keys are committed before
+    any events row refers to them, whatever happens to the writer's
+    transaction. Resolved keys are kept in process; the cache is simply
+    emptied once it passes `maxsize`.
+    """
+    
+    def __init__(self, model, column: str, maxsize: int = DIMENSION_CACHE_SIZE):
+        self.model = model
+        self.column = getattr(model, column)
+        self.maxsize = maxsize
+        self._keys: Dict[str, int] = {}
+        self._values: Dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def _remember(self, pairs: Iterable):
+        if len(self._keys) >= self.maxsize:
+            self._keys.clear()
+            self._values.clear()
+        for key, value in pairs:
+            self._keys[value] = key
+            self._values[key] = value
+    
+    async def _fetch(self, conn, values: List[str]) -> List:
+        rows = []
+        for i in range(0, len(values), DIMENSION_RESOLVE_CHUNK):
+            chunk = values[i:i + DIMENSION_RESOLVE_CHUNK]
+            result = await conn.execute(select(self.model.id, self.column).where(self.column.in_(chunk)))
+            rows.extend(result.all())
+        return rows
+    
+    async def resolve(self, values: Iterable[str]) -> Dict[str, int]:
+        """Keys for every value, creating the missing ones"""
+        values = set(values)
+        known = {v: self._keys[v] for v in values if v in self._keys}
+        # Sorted so concurrent resolvers take the unique-index locks in the same order
+        missing = sorted(v for v in values if v not in known)
+        self.hits += len(known)
+        self.misses += len(missing)
+        
+        if missing:
+            async with engine.begin() as conn:
+                for i in range(0, len(missing), DIMENSION_RESOLVE_CHUNK):
+                    chunk = missing[i:i + DIMENSION_RESOLVE_CHUNK]
+                    await conn.execute(
+                        insert(self.model)
+                        .values([{self.column.key: v} for v in chunk])
+                        .on_conflict_do_nothing(index_elements=[self.column.key])
+                    )
+                rows = await self._fetch(conn, missing)
+            self._remember(rows)
+            known.update((value, key) for key, value in rows)
+        return known
+    
+    async def lookup(self, values: Iterable[str]) -> Dict[str, int]:
+        """Keys for the values that exist, without creating any"""
+        values = set(values)
+        known = {v: self._keys[v] for v in values if v in self._keys}
+        missing = [v for v in values if v not in known]
+        if missing:
+            async with engine.connect() as conn:
+                rows = await self._fetch(conn, missing)
+            self._remember(rows)
+            known.update((value, key) for key, value in rows)
+        return known
+    
+    async def names(self, keys: Iterable[int]) -> Dict[int, str]:
+        """Values for surrogate keys, e.g. to label grouped query results"""
+        keys = set(keys)
+        known = {k: self._values[k] for k in keys if k in self._values}
+        missing = [k for k in keys if k not in known]
+        if missing:
+            rows = []
+            async with engine.connect() as conn:
+                for i in range(0, len(missing), DIMENSION_RESOLVE_CHUNK):
+                    chunk = missing[i:i + DIMENSION_RESOLVE_CHUNK]
+                    result = await conn.execute(select(self.model.id, self.column).where(self.model.id.in_(chunk)))
+                    rows.extend(result.all())
+            self._remember(rows)
+            known.update(rows)
+        return known
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._keys),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+users = DimensionCache(User, "external_id")
+event_names = DimensionCache(EventName, "name", maxsize=50000)
+sources = DimensionCache(Source, "name", maxsize=1000)
+
+def dimension_stats() -> Dict[str, Dict]:
+    return {"users": users.stats(), "event_names": event_names.stats(), "sources": sources.stats()}
\ No newline at end of file
@@ -0,0 +1,181 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from database import AsyncSessionLocal
+from batch import EventBatch
+from writer import BulkEventWriter
+
+EVENT_QUEUE_MAX_EVENTS = int(os.getenv("EVENT_QUEUE_MAX_EVENTS", "200000"))
+EVENT_QUEUE_FLUSH_SIZE = int(os.getenv("EVENT_QUEUE_FLUSH_SIZE", "20000"))
+EVENT_QUEUE_FLUSH_INTERVAL = float(os.getenv("EVENT_QUEUE_FLUSH_INTERVAL", "1.0"))
+EVENT_QUEUE_FLUSH_RETRIES = 3
+# Largest /events body accepted, checked both as sent and after gzip decoding
+PUSH_MAX_BODY_BYTES = int(os.getenv("PUSH_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+
+def reject_json_constant(name: str):
+    """parse_constant for json.loads: NaN and Infinity aren't JSON and can't be stored in JSONB"""
+    raise ValueError(f"{name} is not a valid JSON value")
+
+def parse_pushed_event(data: Dict) -> Dict:
+    """Validate one pushed event in the normalized connector shape"""
+    timestamp = data["timestamp"]
+    try:
+        if isinstance(timestamp, (int, float)):
+            timestamp = datetime.utcfromtimestamp(timestamp)
+        else:
+            timestamp = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+    except (OverflowError, OSError):
+        raise ValueError(f"timestamp out of range: {timestamp}")
+    
+    if not data["user_id"] or not data["event_name"]:
+        raise ValueError("user_id and event_name are required")
+    # Checked here, so one bad event can't fail the shared flush for every client
+    properties = data.get("properties") or {}
+    if not isinstance(properties, dict):
+        raise ValueError("properties must be an object")
+    session_id = data.get("session_id")
+    if session_id is not None:
+        # Numeric session ids (Amplitude's, for one) are stored as strings like the connectors do
+        if isinstance(session_id, bool) or not isinstance(session_id, (str, int)):
+            raise ValueError("session_id must be a string")
+        session_id = str(session_id)
+    
+    return {
+        "user_id": str(data["user_id"]),
+        "session_id": session_id,
+        "event_name": str(data["event_name"]),
+        "timestamp": timestamp,
+        "properties": properties
+    }
+
+class EventQueue:
+    """Bounded in-process queue drained by a write-behind background writer.
+    
+    Pushed batches are accepted until `max_events` are waiting; past that
+    `offer` refuses them so the endpoint can answer 429. The writer flushes
+    whenever `flush_size` events have collected or `flush_interval` seconds
+    have passed since the first one arrived.
+    """
+    
+    def __init__(
+        self,
+        max_events: int = EVENT_QUEUE_MAX_EVENTS,
+        flush_size: int = EVENT_QUEUE_FLUSH_SIZE,
+        flush_interval: float = EVENT_QUEUE_FLUSH_INTERVAL
+    ):
+        self.max_events = max_events
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending = 0
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush: Optional[datetime] = None
+    
+    @property
+    def depth(self) -> int:
+        return self._pending
+    
+    def offer(self, source: str, events: EventBatch) -> bool:
+        """Enqueue a batch, or return False when the queue is full"""
+        if self._pending + len(events) > self.max_events:
+            self.rejected += len(events)
+            return False
+        
+        self._pending += len(events)
+        self.accepted += len(events)
+        self._queue.put_nowait((source, events))
+        return True
+    
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush everything still queued, then stop the writer"""
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            
+            batch: Dict[str, EventBatch] = {}
+            count = 0
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            
+            while item is not None:
+                source, events = item
+                batch.setdefault(source, EventBatch()).extend(events)
+                count += len(events)
+                if count >= self.flush_size:
+                    break
+                
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+            
+            await self._flush(batch, count)
+            if stopping:
+                return
+    
+    async def _flush(self, batch: Dict[str, EventBatch], count: int):
+        """Write each source on its own transaction, so one that keeps failing drops only its events"""
+        try:
+            for source, events in batch.items():
+                if await self._write_source(source, events):
+                    self.written += len(events)
+                else:
+                    self.dropped += len(events)
+            self.flushes += 1
+            self.last_flush = datetime.utcnow()
+        finally:
+            self._pending -= count
+    
+    async def _write_source(self, source: str, events: EventBatch) -> bool:
+        for attempt in range(1, EVENT_QUEUE_FLUSH_RETRIES + 1):
+            try:
+                async with AsyncSessionLocal() as db:
+                    writer = BulkEventWriter(db, source)
+                    await writer.write(events)
+                    await writer.close()
+                    await db.commit()
+                return True
+            except Exception as e:
+                print(f"Event queue flush error for {source} (attempt {attempt}): {e}")
+                if attempt < EVENT_QUEUE_FLUSH_RETRIES:
+                    await asyncio.sleep(attempt)
+        print(f"Event queue dropped {len(events)} events for {source}")
+        return False
+    
+    def stats(self) -> Dict:
+        return {
+            "depth": self._pending,
+            "max_events": self.max_events,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "last_flush": self.last_flush.isoformat() if self.last_flush else None
+        }
+
+event_queue = EventQueue()
\ No newline at end of file
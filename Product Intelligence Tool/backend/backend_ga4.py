@@ -1,60 +1,107 @@
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
-from datetime import datetime
-from typing import List, Dict
-import hashlib
+from google.api_core import exceptions as google_exceptions
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Dict, Tuple
 import os
 
+from integrations.hashing import user_id_hasher
+from integrations.ratelimit import get_limiter
+from batch import EventBatch, merge_pages
+
+def _classify_error(e: Exception):
+    """Map Data API errors onto the shared retry policy"""
+    if isinstance(e, google_exceptions.ResourceExhausted):
+        return "throttled"
+    if isinstance(e, (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded)):
+        return "retry"
+    return None
+
 class GA4Client:
-    def __init__(self, credentials_path: str, property_id: str):
+    def __init__(
+        self,
+        credentials_path: str,
+        property_id: str,
+        page_size: int = 100000,
+        chunk_days: int = 7,
+        concurrency: int = 4
+    ):
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
         self.client = BetaAnalyticsDataClient()
         self.property_id = property_id
+        self.page_size = page_size
+        self.chunk_days = chunk_days
+        self.concurrency = concurrency
     
     async def fetch_events(self, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Fetch events from GA4 Data API"""
-        events = []
+        events = EventBatch()
+        async for batch in self.stream_events(start_date, end_date):
+            events.extend(batch)
+        return events.to_events()
+    
+    async def stream_events(self, start_date: datetime, end_date: datetime) -> AsyncIterator[EventBatch]:
+        """Page through date sub-ranges concurrently, off the event loop, yielding each page"""
+        limiter = get_limiter("ga4")
         
-        try:
-            request = RunReportRequest(
-                property=f"properties/{self.property_id}",
-                date_ranges=[DateRange(
-                    start_date=start_date.strftime("%Y-%m-%d"),
-                    end_date=end_date.strftime("%Y-%m-%d")
-                )],
-                dimensions=[
-                    Dimension(name="eventName"),
-                    Dimension(name="userId"),
-                    Dimension(name="sessionId"),
-                    Dimension(name="date")
-                ],
-                metrics=[Metric(name="eventCount")]
-            )
-            
-            response = self.client.run_report(request)
-            
-            for row in response.rows:
-                event_name = row.dimension_values[0].value
-                user_id = row.dimension_values[1].value
-                session_id = row.dimension_values[2].value
-                date_str = row.dimension_values[3].value
-                
-                # Parse date (format: YYYYMMDD)
-                event_date = datetime.strptime(date_str, "%Y%m%d")
-                
-                normalized = {
-                    "user_id": self._hash_user_id(user_id) if user_id != "(not set)" else "anonymous",
-                    "session_id": session_id if session_id != "(not set)" else None,
-                    "event_name": event_name,
-                    "timestamp": event_date,
-                    "properties": {}
-                }
-                events.append(normalized)
-                
-        except Exception as e:
-            print(f"GA4 fetch error: {e}")
+        async def range_pages(range_start: str, range_end: str) -> AsyncIterator[EventBatch]:
+            offset = 0
+            while True:
+                # run_report is a blocking gRPC call
+                response = await limiter.call(
+                    asyncio.to_thread, self._run_report, range_start, range_end, offset,
+                    classify=_classify_error
+                )
+                if response.rows:
+                    yield self._normalize_rows(response.rows)
+                offset += len(response.rows)
+                if not response.rows or offset >= response.row_count:
+                    break
         
-        return events
+        # A range that exhausted its retries fails the whole fetch
+        ranges = [range_pages(range_start, range_end) for range_start, range_end in self._date_ranges(start_date, end_date)]
+        async for page in merge_pages(ranges, self.concurrency):
+            yield page
     
-    def _hash_user_id(self, user_id: str) -> str:
-        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
\ No newline at end of file
+    def _date_ranges(self, start_date: datetime, end_date: datetime) -> List[Tuple[str, str]]:
+        """Split the inclusive date range into chunk_days-sized sub-ranges"""
+        ranges = []
+        day = start_date.date()
+        last_day = end_date.date()
+        while day <= last_day:
+            chunk_end = min(day + timedelta(days=self.chunk_days - 1), last_day)
+            ranges.append((day.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+            day = chunk_end + timedelta(days=1)
+        return ranges
+    
+    def _run_report(self, range_start: str, range_end: str, offset: int):
+        request = RunReportRequest(
+            property=f"properties/{self.property_id}",
+            date_ranges=[DateRange(start_date=range_start, end_date=range_end)],
+            dimensions=[
+                Dimension(name="eventName"),
+                Dimension(name="userId"),
+                Dimension(name="sessionId"),
+                Dimension(name="date")
+            ],
+            metrics=[Metric(name="eventCount")],
+            limit=self.page_size,
+            offset=offset
+        )
+        return self.client.run_report(request)
+    
+    def _normalize_rows(self, rows) -> EventBatch:
+        dimensions = [[value.value for value in row.dimension_values] for row in rows]
+        user_ids = [d[1] for d in dimensions]
+        hashed = iter(user_id_hasher.hash_many(uid for uid in user_ids if uid != "(not set)"))
+        
+        return EventBatch(
+            user_id=[next(hashed) if uid != "(not set)" else "anonymous" for uid in user_ids],
+            session_id=[d[2] if d[2] != "(not set)" else None for d in dimensions],
+            event_name=[d[0] for d in dimensions],
+            # Dates come as YYYYMMDD
+            timestamp=[datetime.strptime(d[3], "%Y%m%d") for d in dimensions],
+            # Each row aggregates eventCount events; keep it as the row's weight
+            properties=[{"event_count": int(row.metric_values[0].value)} for row in rows]
+        )
\ No newline at end of file
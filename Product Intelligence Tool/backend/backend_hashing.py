@@ -0,0 +1,48 @@
+import hashlib
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+USER_HASH_CACHE_SIZE = int(os.getenv("USER_HASH_CACHE_SIZE", "262144"))
+
+class UserIdHasher:
+    """Privacy hash for vendor user ids, memoized with a bounded LRU cache.
+    
+    Produces the same 16-hex-char truncated sha256 the connectors have always
+    stored, so existing user_id values keep matching.
+    """
+    
+    def __init__(self, maxsize: int = USER_HASH_CACHE_SIZE):
+        self._digest = lru_cache(maxsize=maxsize)(self._compute)
+    
+    @staticmethod
+    def _compute(user_id: str) -> str:
+        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
+    
+    def hash(self, user_id: str) -> str:
+        return self._digest(user_id)
+    
+    def hash_many(self, user_ids: Iterable[str]) -> List[str]:
+        """Hash a whole page, computing each distinct id once"""
+        user_ids = list(user_ids)
+        hashed: Dict[str, str] = {uid: self._digest(uid) for uid in set(user_ids)}
+        return [hashed[uid] for uid in user_ids]
+    
+    def stats(self) -> Dict:
+        info = self._digest.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0
+        }
+    
+    def clear(self):
+        self._digest.cache_clear()
+
+user_id_hasher = UserIdHasher()
+
+def hash_user_id(user_id: str) -> str:
+    return user_id_hasher.hash(user_id)
\ No newline at end of file
@@ -1,7 +1,10 @@
-import httpx
 from datetime import datetime
-from typing import List, Dict
-import hashlib
+from typing import AsyncIterator, List, Dict
+
+from transport import get_http_client
+from integrations.hashing import user_id_hasher
+from integrations.ratelimit import get_limiter
+from batch import EventBatch
 
 class HeapClient:
     def __init__(self, api_key: str):
@@ -10,43 +13,40 @@ class HeapClient:
     
     async def fetch_events(self, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Fetch events from Heap API"""
-        events = []
+        events = EventBatch()
+        async for batch in self.stream_events(start_date, end_date):
+            events.extend(batch)
+        return events.to_events()
+    
+    async def stream_events(self, start_date: datetime, end_date: datetime) -> AsyncIterator[EventBatch]:
+        """Heap answers in one response; yield it as a single columnar batch"""
+        client = get_http_client()
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            try:
-                params = {
-                    "from_date": start_date.strftime("%Y-%m-%d"),
-                    "to_date": end_date.strftime("%Y-%m-%d")
-                }
-                
-                response = await client.get(
-                    f"{self.base_url}/track/events",
-                    params=params,
-                    headers=headers
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                for event_data in data.get("events", []):
-                    normalized = {
-                        "user_id": self._hash_user_id(event_data.get("user_id", "")),
-                        "session_id": event_data.get("session_id"),
-                        "event_name": event_data["event"],
-                        "timestamp": datetime.fromisoformat(event_data["time"]),
-                        "properties": event_data.get("properties", {})
-                    }
-                    events.append(normalized)
-                
-            except Exception as e:
-                print(f"Heap fetch error: {e}")
+        params = {
+            "from_date": start_date.strftime("%Y-%m-%d"),
+            "to_date": end_date.strftime("%Y-%m-%d")
+        }
         
-        return events
-    
-    def _hash_user_id(self, user_id: str) -> str:
-        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
\ No newline at end of file
+        response = await get_limiter("heap").request(
+            client,
+            "GET",
+            f"{self.base_url}/track/events",
+            params=params,
+            headers=headers
+        )
+        
+        data = response.json()
+        
+        raw_events = data.get("events", [])
+        if raw_events:
+            yield EventBatch(
+                user_id=user_id_hasher.hash_many(e.get("user_id", "") for e in raw_events),
+                session_id=[e.get("session_id") for e in raw_events],
+                event_name=[e["event"] for e in raw_events],
+                timestamp=[datetime.fromisoformat(e["time"]) for e in raw_events],
+                properties=[e.get("properties", {}) for e in raw_events]
+            )
\ No newline at end of file
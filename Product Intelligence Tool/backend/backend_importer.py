@@ -0,0 +1,203 @@
+"""Offline bulk import of vendor export files.
+
+Usage (from the backend directory):
+    
+    python -m importer --source mixpanel export-2024-01.jsonl export-2024-02.jsonl.gz
+    python -m importer --source amplitude 123456.zip --workers 8
+
+Plain JSONL files are memory-mapped and split into newline-aligned byte
+ranges that worker processes read directly. Gzip files and the members of
+an Amplitude ZIP are decompressed as a stream and handed to workers in line
+blocks, so no file or member is ever held in memory whole. Workers reuse
+the connector's normalize_batch and ship back prepared columns, so the
+main process only writes them through BulkEventWriter.
+"""
+import argparse
+import asyncio
+import gzip
+import importlib
+import json
+import mmap
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+from database import AsyncSessionLocal, init_db
+from integrations.registry import CONNECTORS
+from batch import EventBatch
+from writer import BulkEventWriter, prepare_batch
+
+# Sources whose export files the importer understands
+FILE_SOURCES = ("mixpanel", "amplitude")
+IMPORT_BLOCK_SIZE = 16 * 1024 * 1024
+
+_normalizers: Dict[str, object] = {}
+
+def _normalizer(source: str):
+    """Connector normalize_batch, imported once per worker process"""
+    if source not in _normalizers:
+        module_name, class_name, _ = CONNECTORS[source]
+        _normalizers[source] = getattr(importlib.import_module(module_name), class_name).normalize_batch
+    return _normalizers[source]
+
+def _parse_lines(source: str, lines: List[bytes]) -> Tuple[Dict[str, list], int]:
+    """Parse and normalize raw JSONL lines into prepared columns, counting lines that fail"""
+    raw_events = []
+    bad = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            raw_events.append(json.loads(line))
+        except ValueError:
+            bad += 1
+    
+    normalize = _normalizer(source)
+    try:
+        events = normalize(raw_events)
+    except (KeyError, TypeError, ValueError):
+        # One malformed record shouldn't sink the whole block
+        events = EventBatch()
+        for raw in raw_events:
+            try:
+                events.extend(normalize([raw]))
+            except (KeyError, TypeError, ValueError):
+                bad += 1
+    
+    return prepare_batch(source, events, datetime.utcnow()), bad
+
+def parse_range(source: str, path: str, start: int, end: int) -> Tuple[Dict[str, list], int]:
+    """Worker task: parse a newline-aligned byte range of an uncompressed file"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _parse_lines(source, mm[start:end].splitlines())
+
+def parse_block(source: str, data: bytes) -> Tuple[Dict[str, list], int]:
+    """Worker task: parse a block of decompressed lines"""
+    return _parse_lines(source, data.splitlines())
+
+def _byte_ranges(path: str, block_size: int) -> Iterator[Tuple[int, int]]:
+    """Split a file into ranges of about block_size that end on a newline"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b"\n", min(start + block_size, size))
+            end = size if end == -1 else end + 1
+            yield start, end
+            start = end
+
+def _line_blocks(f, block_size: int) -> Iterator[bytes]:
+    """Read a binary stream in blocks of about block_size cut on whole lines"""
+    carry = b""
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        data = carry + data
+        cut = data.rfind(b"\n") + 1
+        carry = data[cut:]
+        if cut:
+            yield data[:cut]
+    if carry:
+        yield carry
+
+def _gzip_blocks(path: str, block_size: int) -> Iterator[bytes]:
+    """Stream a gzip file and cut it into blocks of whole lines"""
+    with gzip.open(path, "rb") as f:
+        yield from _line_blocks(f, block_size)
+
+def _zip_member_blocks(path: str, member: str, block_size: int) -> Iterator[bytes]:
+    """Stream one (possibly gzipped) member of an export archive in blocks of whole lines"""
+    with zipfile.ZipFile(path) as zf, zf.open(member) as raw:
+        f = gzip.GzipFile(fileobj=raw) if member.endswith(".gz") else raw
+        yield from _line_blocks(f, block_size)
+
+def plan_tasks(source: str, path: str, block_size: int = IMPORT_BLOCK_SIZE) -> Iterator[tuple]:
+    """Worker calls (function, *args) that together cover one export file"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            members = [m.filename for m in zf.infolist() if not m.is_dir()]
+        for member in members:
+            for block in _zip_member_blocks(path, member, block_size):
+                yield (parse_block, source, block)
+    elif path.endswith(".gz"):
+        for block in _gzip_blocks(path, block_size):
+            yield (parse_block, source, block)
+    else:
+        for start, end in _byte_ranges(path, block_size):
+            yield (parse_range, source, path, start, end)
+
+async def import_files(
+    source: str,
+    paths: List[str],
+    workers: int = os.cpu_count() or 4,
+    block_size: int = IMPORT_BLOCK_SIZE,
+    chunk_size: int = 5000
+) -> Dict:
+    """Parse export files in a process pool and bulk-write the rows, committing per block"""
+    if source not in FILE_SOURCES:
+        raise ValueError(f"Unsupported source for file import: {source}")
+    
+    loop = asyncio.get_running_loop()
+    totals = {"rows": 0, "skipped": 0, "rejected": 0, "bad_lines": 0, "blocks": 0}
+    started = time.monotonic()
+    
+    async def write(columns: Dict[str, list], bad: int):
+        async with AsyncSessionLocal() as db:
+            writer = BulkEventWriter(db, source, chunk_size=chunk_size)
+            await writer.write_prepared(columns)
+            stats = await writer.close()
+            await db.commit()
+        totals["rows"] += stats["rows"]
+        totals["skipped"] += stats["skipped"]
+        totals["rejected"] += stats["rejected"]
+        totals["bad_lines"] += bad
+        totals["blocks"] += 1
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        try:
+            for path in paths:
+                for fn, *args in plan_tasks(source, path, block_size):
+                    pending.add(loop.run_in_executor(pool, fn, *args))
+                    # Bound parsed-but-unwritten blocks held in memory
+                    if len(pending) >= workers * 2:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for future in done:
+                            await write(*future.result())
+            
+            for future in asyncio.as_completed(pending):
+                await write(*await future)
+            pending = set()
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    seconds = time.monotonic() - started
+    totals["seconds"] = round(seconds, 3)
+    totals["rows_per_sec"] = round((totals["rows"] + totals["skipped"]) / seconds, 1) if seconds > 0 else 0.0
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Import vendor export files into the events table")
+    parser.add_argument("--source", required=True, choices=FILE_SOURCES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Parser processes")
+    parser.add_argument("--block-size", type=int, default=IMPORT_BLOCK_SIZE, help="Bytes per parse task")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows per COPY chunk")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    
+    async def run():
+        await init_db()
+        return await import_files(args.source, args.paths, args.workers, args.block_size, args.chunk_size)
+    
+    print(json.dumps(asyncio.run(run())))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
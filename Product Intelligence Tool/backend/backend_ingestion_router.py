@@ -1,118 +1,247 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime
+import json
+import zlib
 
-from database import get_db, Event, SyncState
-from integrations.mixpanel import MixpanelClient
-from integrations.amplitude import AmplitudeClient
-from integrations.posthog import PostHogClient
-from integrations.heap import HeapClient
-from integrations.ga4 import GA4Client
+from database import get_db, replica_router, SyncState, SourceConnection
+from sync import SourceConfig
+from sync_jobs import sync_jobs
+from integrations.hashing import user_id_hasher
+from event_queue import event_queue, parse_pushed_event, reject_json_constant, PUSH_MAX_BODY_BYTES
+from batch import EventBatch
+from integrations.registry import connector_registry
+from integrations.ratelimit import throttle_stats
+from dimensions import dimension_stats
+from jobs import schedule_source_sync, unschedule_source_sync
+from properties import PROMOTED_BACKFILL_STATE
+from rollup import COMPACTION_STATE
+
+INTERNAL_SYNC_STATES = (COMPACTION_STATE, PROMOTED_BACKFILL_STATE)
 
 router = APIRouter()
 
-class SourceConfig(BaseModel):
-    source: str
+class IngestRequest(BaseModel):
+    configs: List[SourceConfig]
+
+class BackfillRequest(BaseModel):
+    config: SourceConfig
+    start_date: datetime
+    end_date: Optional[datetime] = None
+    shard: str = "day"
+    workers: int = 4
+    restart: bool = False
+
+class SourceConnectionRequest(BaseModel):
     api_key: Optional[str] = None
     api_secret: Optional[str] = None
     project_id: Optional[str] = None
     workspace_id: Optional[str] = None
     lookback_days: int = 7
+    sync_interval_minutes: int = 60
+    enabled: bool = True
 
-class IngestRequest(BaseModel):
-    configs: List[SourceConfig]
+def _source_connection_dict(connection: SourceConnection) -> dict:
+    return {
+        "source": connection.source,
+        "api_key": "***" if connection.api_key else None,
+        "api_secret": "***" if connection.api_secret else None,
+        "project_id": connection.project_id,
+        "workspace_id": connection.workspace_id,
+        "lookback_days": connection.lookback_days,
+        "sync_interval_minutes": connection.sync_interval_minutes,
+        "enabled": connection.enabled,
+        "updated_at": connection.updated_at.isoformat() if connection.updated_at else None
+    }
+
+@router.get("/sources")
+async def list_sources(db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(SourceConnection).order_by(SourceConnection.source))
+    return {"sources": [_source_connection_dict(c) for c in result.scalars().all()]}
+
+@router.put("/sources/{source}")
+async def save_source(source: str, request: SourceConnectionRequest, db: AsyncSession = Depends(get_db)):
+    """Store a source's credentials and sync interval, and (re)schedule its incremental sync"""
+    if source not in connector_registry:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
+    if request.sync_interval_minutes < 1:
+        raise HTTPException(status_code=400, detail="sync_interval_minutes must be at least 1")
+    
+    result = await db.execute(select(SourceConnection).where(SourceConnection.source == source))
+    connection = result.scalar_one_or_none()
+    if not connection:
+        connection = SourceConnection(source=source)
+        db.add(connection)
+        fields = request.model_dump()
+    else:
+        # A partial update keeps what it leaves out, including stored credentials
+        fields = request.model_dump(exclude_unset=True)
+    for field, value in fields.items():
+        # GET masks credentials as "***"; sending that back must not overwrite them
+        if field in ("api_key", "api_secret") and value == "***":
+            continue
+        setattr(connection, field, value)
+    await db.commit()
+    await db.refresh(connection)
+    
+    if connection.enabled:
+        schedule_source_sync(connection)
+    else:
+        unschedule_source_sync(source)
+    return _source_connection_dict(connection)
+
+@router.delete("/sources/{source}")
+async def delete_source(source: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(SourceConnection).where(SourceConnection.source == source))
+    connection = result.scalar_one_or_none()
+    if not connection:
+        raise HTTPException(status_code=404, detail="Source not found")
+    
+    await db.delete(connection)
+    await db.commit()
+    unschedule_source_sync(source)
+    return {"source": source, "deleted": True}
+
+@router.post("/sync", status_code=202)
+async def sync_sources(request: IngestRequest):
+    """Start a background sync job and return its id immediately"""
+    job = sync_jobs.submit(request.configs)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/ingestion/jobs/{job.id}"
+    }
+
+@router.get("/jobs")
+async def list_sync_jobs():
+    return {"jobs": [job.to_dict() for job in sync_jobs.list()]}
+
+@router.get("/jobs/{job_id}")
+async def get_sync_job(job_id: str):
+    job = sync_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_sync_job(job_id: str):
+    job = sync_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job.id, "status": "cancelled" if job.done else "cancelling"}
+
+@router.post("/backfill", status_code=202)
+async def backfill_source(request: BackfillRequest):
+    """Start a backfill job and return its id immediately"""
+    if request.config.source not in connector_registry:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {request.config.source}")
+    client = connector_registry.get(request.config)
+    if request.shard not in ("day", "hour"):
+        raise HTTPException(status_code=400, detail="shard must be 'day' or 'hour'")
+    
+    job = sync_jobs.submit_backfill(
+        request.config,
+        client,
+        request.start_date,
+        request.end_date or datetime.utcnow(),
+        granularity=request.shard,
+        workers=request.workers,
+        restart=request.restart
+    )
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/ingestion/jobs/{job.id}"
+    }
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Body exceeds {PUSH_MAX_BODY_BYTES} bytes")
+
+async def _read_body(request: Request) -> bytes:
+    """The request body, refused with 413 as soon as it passes PUSH_MAX_BODY_BYTES"""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > PUSH_MAX_BODY_BYTES:
+        raise _too_large()
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > PUSH_MAX_BODY_BYTES:
+            raise _too_large()
+    return bytes(body)
 
-async def ingest_from_source(config: SourceConfig, db: AsyncSession):
-    try:
-        client = None
-        if config.source == "mixpanel":
-            client = MixpanelClient(config.api_key, config.api_secret)
-        elif config.source == "amplitude":
-            client = AmplitudeClient(config.api_key, config.api_secret)
-        elif config.source == "posthog":
-            client = PostHogClient(config.api_key, config.project_id)
-        elif config.source == "heap":
-            client = HeapClient(config.api_key)
-        elif config.source == "ga4":
-            client = GA4Client(config.api_key, config.project_id)
-        else:
-            return {"error": f"Unknown source: {config.source}"}
-        
-        # Get last sync
-        result = await db.execute(select(SyncState).where(SyncState.source == config.source))
-        sync_state = result.scalar_one_or_none()
-        
-        if sync_state and sync_state.last_sync:
-            start_date = sync_state.last_sync
-        else:
-            start_date = datetime.utcnow() - timedelta(days=config.lookback_days)
-        
-        end_date = datetime.utcnow()
-        
-        # Fetch events
-        events = await client.fetch_events(start_date, end_date)
-        
-        # Normalize and insert
-        for event_data in events:
-            event = Event(
-                user_id=event_data.get("user_id"),
-                session_id=event_data.get("session_id"),
-                event_name=event_data.get("event_name"),
-                timestamp=event_data.get("timestamp"),
-                source=config.source,
-                properties=event_data.get("properties", {})
-            )
-            db.add(event)
-        
-        # Update sync state
-        if sync_state:
-            sync_state.last_sync = end_date
-            sync_state.status = "success"
-        else:
-            sync_state = SyncState(
-                source=config.source,
-                last_sync=end_date,
-                status="success"
-            )
-            db.add(sync_state)
-        
-        await db.commit()
-        return {"status": "success", "events_ingested": len(events)}
+def _gunzip(data: bytes) -> bytes:
+    """Decode a (possibly multi-member) gzip body without inflating past PUSH_MAX_BODY_BYTES"""
+    out = bytearray()
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            out += decompressor.decompress(data, PUSH_MAX_BODY_BYTES - len(out) + 1)
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Body is not valid gzip")
+        if len(out) > PUSH_MAX_BODY_BYTES:
+            raise _too_large()
+        if not decompressor.eof:
+            raise HTTPException(status_code=400, detail="Body is not valid gzip")
+        data = decompressor.unused_data
+    return bytes(out)
+
+@router.post("/events", status_code=202)
+async def push_events(request: Request, source: str = Query("api")):
+    """Accept an NDJSON (optionally gzip-encoded) batch of normalized events"""
+    body = await _read_body(request)
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        body = _gunzip(body)
+    
+    events = EventBatch()
+    for line_no, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            events.append(**parse_pushed_event(json.loads(line, parse_constant=reject_json_constant)))
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid event on line {line_no}: {e}")
     
-    except Exception as e:
-        # Update sync state with error
-        if sync_state:
-            sync_state.status = "error"
-            sync_state.metadata = {"error": str(e)}
-            await db.commit()
-        return {"status": "error", "message": str(e)}
-
-@router.post("/sync")
-async def sync_sources(
-    request: IngestRequest,
-    background_tasks: BackgroundTasks,
-    db: AsyncSession = Depends(get_db)
-):
-    results = []
-    for config in request.configs:
-        result = await ingest_from_source(config, db)
-        results.append({"source": config.source, "result": result})
+    if not event_queue.offer(source, events):
+        raise HTTPException(
+            status_code=429,
+            detail="Ingestion queue is full",
+            headers={"Retry-After": "1"}
+        )
     
-    return {"results": results}
+    return {"accepted": len(events), "queue_depth": event_queue.depth}
+
+def _internal_state(state: Optional[SyncState]) -> Optional[dict]:
+    if state is None:
+        return None
+    return {"status": state.status, **(state.metadata or {})}
 
 @router.get("/status")
 async def get_sync_status(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(SyncState))
     states = result.scalars().all()
-    return {"sync_states": [
-        {
-            "source": s.source,
-            "last_sync": s.last_sync.isoformat() if s.last_sync else None,
-            "status": s.status,
-            "metadata": s.metadata
-        }
-        for s in states
-    ]}
\ No newline at end of file
+    # Compaction and the promoted column backfill keep their progress in sync_state
+    # too; they are reported on their own rather than as sources
+    internal = {s.source: s for s in states if s.source in INTERNAL_SYNC_STATES}
+    return {
+        "sync_states": [
+            {
+                "source": s.source,
+                "last_sync": s.last_sync.isoformat() if s.last_sync else None,
+                "status": s.status,
+                "metadata": s.metadata
+            }
+            for s in states
+            if s.source not in internal
+        ],
+        "compaction": _internal_state(internal.get(COMPACTION_STATE)),
+        "promoted_backfill": _internal_state(internal.get(PROMOTED_BACKFILL_STATE)),
+        "user_hash_cache": user_id_hasher.stats(),
+        "event_queue": event_queue.stats(),
+        "connectors": connector_registry.stats(),
+        "throttle": throttle_stats(),
+        "dimensions": dimension_stats(),
+        "read_replica": replica_router.stats()
+    }
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""init_db against a live Postgres.
+
+Set TEST_DATABASE_URL to a disposable database to run these; its public
+schema is dropped before every test.
+"""
+import json
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+from database import AsyncSessionLocal, engine, init_db
+import dimensions
+import partitions
+from writer import BulkEventWriter
+
+def _events(count: int, day: datetime) -> list:
+    return [
+        {
+            "user_id": f"user-{i % 3}",
+            "session_id": None,
+            "event_name": "page_view" if i % 2 else "signup",
+            "timestamp": day + timedelta(minutes=i),
+            "properties": {"path": f"/page/{i}"}
+        }
+        for i in range(count)
+    ]
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL not set")
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    """Starts every test from an empty schema and fresh in-process caches"""
+    
+    async def asyncSetUp(self):
+        async with engine.begin() as conn:
+            await conn.execute(text("DROP SCHEMA public CASCADE"))
+            await conn.execute(text("CREATE SCHEMA public"))
+        for cache in (dimensions.users, dimensions.event_names, dimensions.sources):
+            cache._keys.clear()
+            cache._values.clear()
+        partitions._known_partitions.clear()
+        self.day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    
+    async def asyncTearDown(self):
+        await engine.dispose()
+    
+    async def _write(self, source: str, events: list) -> dict:
+        async with AsyncSessionLocal() as db:
+            writer = BulkEventWriter(db, source)
+            await writer.write(events)
+            stats = await writer.close()
+            await db.commit()
+        return stats
+    
+    async def _scalar(self, sql: str):
+        async with engine.connect() as conn:
+            return await conn.scalar(text(sql))
+
+class InitDbTest(DatabaseTestCase):
+    
+    async def test_restart_keeps_populated_events_table(self):
+        await init_db()
+        stats = await self._write("mixpanel", _events(10, self.day))
+        self.assertEqual(stats["rows"], 10)
+        
+        await init_db()
+        
+        self.assertEqual(await self._scalar("SELECT count(*) FROM events"), 10)
+        self.assertIsNone(await self._scalar("SELECT to_regclass('events_legacy')"))
+        # Dedup keys survive the restart, so a re-sync of the same window adds nothing
+        stats = await self._write("mixpanel", _events(10, self.day))
+        self.assertEqual((stats["rows"], stats["skipped"]), (0, 10))
+    
+    async def test_legacy_events_table_is_copied_with_writer_dedup_keys(self):
+        # The original, unpartitioned table with string dimensions and no dedup keys
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE events (id SERIAL PRIMARY KEY, user_id VARCHAR NOT NULL, session_id VARCHAR, "
+                "event_name VARCHAR NOT NULL, timestamp TIMESTAMP NOT NULL, source VARCHAR NOT NULL, "
+                "properties JSON, created_at TIMESTAMP)"
+            ))
+            await conn.execute(text(
+                "INSERT INTO events (user_id, session_id, event_name, timestamp, source, properties) "
+                "VALUES (:user_id, :session_id, :event_name, :timestamp, 'mixpanel', CAST(:properties AS json))"
+            ), [dict(e, properties=json.dumps(e["properties"])) for e in _events(10, self.day)])
+        
+        await init_db()
+        
+        self.assertEqual(await self._scalar("SELECT count(*) FROM events WHERE dedup_key IS NOT NULL"), 10)
+        self.assertIsNone(await self._scalar("SELECT to_regclass('events_legacy')"))
+        stats = await self._write("mixpanel", _events(10, self.day))
+        self.assertEqual((stats["rows"], stats["skipped"]), (0, 10))
+        
+        await init_db()
+        
+        self.assertEqual(await self._scalar("SELECT count(*) FROM events"), 10)
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -4,7 +4,7 @@ from sqlalchemy import select, and_
 from typing import Optional
 from datetime import datetime
 
-from database import get_db, Insight
+from database import get_db, get_read_db, Insight
 
 router = APIRouter()
 
@@ -14,7 +14,7 @@ async def get_insights(
     severity: Optional[str] = Query(None),
     resolved: Optional[str] = Query(None),
     limit: int = Query(50),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Insight)
     
@@ -52,7 +52,7 @@ async def get_insights(
 @router.get("/{insight_id}")
 async def get_insight(
     insight_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     result = await db.execute(select(Insight).where(Insight.id == insight_id))
     insight = result.scalar_one_or_none()
@@ -89,7 +89,7 @@ async def resolve_insight(
     return {"status": "resolved"}
 
 @router.get("/summary/stats")
-async def get_insight_stats(db: AsyncSession = Depends(get_db)):
+async def get_insight_stats(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(Insight))
     all_insights = result.scalars().all()
     
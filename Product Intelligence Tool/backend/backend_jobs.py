@@ -1,14 +1,35 @@
 from sqlalchemy import select, func, and_, distinct
-from datetime import datetime, timedelta
-from database import AsyncSessionLocal, Event, Metric, Insight
+from datetime import date, datetime, timedelta
+import os
+import random
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.base import JobLookupError
+from database import engine as db_engine, AsyncSessionLocal, read_session, Event, Metric, Insight, SourceConnection
+from partitions import ensure_partitions_ahead, apply_retention
+from properties import backfill_promoted
+from compaction import compact_events
+from sync import SourceConfig, sync_one
 from engines.metrics import MetricsEngine
+from engines.columnar import ANALYTICS_BACKEND, ColumnarMetricsEngine, sync_parquet_mirror
 from engines.detection import DetectionEngine
 from llm.client import LLMClient
 
+scheduler = AsyncIOScheduler()
+
+# Random delay added to every scheduled source sync so sources don't fire together
+SYNC_JITTER_SECONDS = int(os.getenv("SYNC_JITTER_SECONDS", "120"))
+
 async def metric_computation_job():
     """Compute all metrics periodically"""
     async with AsyncSessionLocal() as db:
-        engine = MetricsEngine(db)
+        if ANALYTICS_BACKEND == "duckdb":
+            mirrored = await sync_parquet_mirror()
+            if mirrored["days_exported"] or mirrored["days_incomplete"]:
+                print(f"Parquet mirror: {mirrored}")
+            engine = ColumnarMetricsEngine(db, [date.fromisoformat(day) for day in mirrored["days_incomplete"]])
+        else:
+            engine = MetricsEngine(db)
         
         # Compute DAU/WAU/MAU
         await engine.compute_dau()
@@ -28,9 +49,9 @@ async def metric_computation_job():
 
 async def detection_job():
     """Run anomaly detection and generate insights"""
-    async with AsyncSessionLocal() as db:
-        detection_engine = DetectionEngine(db)
-        llm_client = LLMClient()
+    # Detection only reads metrics, so it can run on the replica
+    async with read_session() as read_db:
+        detection_engine = DetectionEngine(read_db)
         
         # Detect metric regressions
         regressions = await detection_engine.detect_regressions()
@@ -43,9 +64,12 @@ async def detection_job():
         
         # Detect retention erosion
         retention_issues = await detection_engine.detect_retention_erosion()
-        
-        # Combine all detections
-        all_detections = regressions + anomalies + decay + retention_issues
+    
+    # Combine all detections
+    all_detections = regressions + anomalies + decay + retention_issues
+    
+    async with AsyncSessionLocal() as db:
+        llm_client = LLMClient()
         
         # Generate insights with LLM explanations
         for detection in all_detections:
@@ -62,4 +86,77 @@ async def detection_job():
             )
             db.add(insight)
         
-        await db.commit()
\ No newline at end of file
+        await db.commit()
+
+async def partition_maintenance_job():
+    """Create upcoming events partitions and expire old ones past retention"""
+    async with db_engine.begin() as conn:
+        created = await ensure_partitions_ahead(conn)
+        expired = await apply_retention(conn)
+    
+    if created or expired:
+        print(f"Partition maintenance: created {created}, expired {expired}")
+
+async def promoted_backfill_job():
+    """Fill newly promoted property columns for events written before they existed"""
+    await backfill_promoted(db_engine)
+
+async def compaction_job():
+    """Roll up and prune raw events past EVENTS_COMPACT_AFTER_DAYS"""
+    stats = await compact_events()
+    if stats and (stats["days_rolled_up"] or stats["rows_deleted"] or stats["partitions_dropped"]):
+        print(f"Compaction: {stats}")
+
+async def source_sync_job(source: str):
+    """Incremental sync of one stored source from its last_sync watermark"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SourceConnection).where(SourceConnection.source == source))
+        connection = result.scalar_one_or_none()
+    
+    if not connection or not connection.enabled:
+        unschedule_source_sync(source)
+        return
+    
+    config = SourceConfig(
+        source=connection.source,
+        api_key=connection.api_key,
+        api_secret=connection.api_secret,
+        project_id=connection.project_id,
+        workspace_id=connection.workspace_id,
+        lookback_days=connection.lookback_days
+    )
+    outcome = await sync_one(config)
+    if outcome["result"].get("status") != "success":
+        print(f"Scheduled sync for {source} failed: {outcome['result']}")
+
+def schedule_source_sync(connection: SourceConnection):
+    """(Re)register a source's interval job, staggered by a random offset within its interval"""
+    interval = timedelta(minutes=connection.sync_interval_minutes)
+    scheduler.add_job(
+        source_sync_job,
+        IntervalTrigger(
+            minutes=connection.sync_interval_minutes,
+            jitter=SYNC_JITTER_SECONDS,
+            start_date=datetime.now() + random.random() * interval
+        ),
+        args=[connection.source],
+        id=f"sync_{connection.source}",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+
+def unschedule_source_sync(source: str):
+    try:
+        scheduler.remove_job(f"sync_{source}")
+    except JobLookupError:
+        pass
+
+async def schedule_source_syncs():
+    """Register interval jobs for every enabled stored source"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SourceConnection).where(SourceConnection.enabled.is_(True)))
+        connections = result.scalars().all()
+    
+    for connection in connections:
+        schedule_source_sync(connection)
\ No newline at end of file
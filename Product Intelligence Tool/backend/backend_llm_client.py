@@ -2,6 +2,8 @@ import os
 import json
 from abc import ABC, abstractmethod
 
+from transport import get_http_client
+
 class LLMProvider(ABC):
     @abstractmethod
     async def generate(self, prompt: str, system: str = None) -> str:
@@ -15,14 +17,14 @@ class OpenAIProvider(LLMProvider):
     async def generate(self, prompt: str, system: str = None) -> str:
         try:
             import openai
-            openai.api_key = self.api_key
+            client = openai.AsyncOpenAI(api_key=self.api_key, http_client=get_http_client())
             
             messages = []
             if system:
                 messages.append({"role": "system", "content": system})
             messages.append({"role": "user", "content": prompt})
             
-            response = await openai.ChatCompletion.acreate(
+            response = await client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.3
@@ -39,7 +41,7 @@ class AnthropicProvider(LLMProvider):
     async def generate(self, prompt: str, system: str = None) -> str:
         try:
             import anthropic
-            client = anthropic.AsyncAnthropic(api_key=self.api_key)
+            client = anthropic.AsyncAnthropic(api_key=self.api_key, http_client=get_http_client())
             
             message = await client.messages.create(
                 model=self.model,
@@ -58,14 +60,13 @@ class OllamaProvider(LLMProvider):
     
     async def generate(self, prompt: str, system: str = None) -> str:
         try:
-            import httpx
-            async with httpx.AsyncClient() as client:
-                full_prompt = f"{system}\n\n{prompt}" if system else prompt
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json={"model": self.model, "prompt": full_prompt, "stream": False}
-                )
-                return response.json()["response"]
+            client = get_http_client()
+            full_prompt = f"{system}\n\n{prompt}" if system else prompt
+            response = await client.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "prompt": full_prompt, "stream": False}
+            )
+            return response.json()["response"]
         except Exception as e:
             return f"Error: {str(e)}"
 
@@ -1,25 +1,91 @@
 from sqlalchemy import select, func, and_, distinct
-from datetime import datetime, timedelta
-from database import Event, Metric
+from sqlalchemy.dialects.postgresql import insert
+from datetime import date, datetime, timedelta
+from typing import Dict, Set
+from database import UserDailyActivity as Activity, Metric
+from dimensions import event_names
 
 class MetricsEngine:
+    """Compute product metrics from the user_daily_activity rollup.
+    
+    Every query reads one row per active user, day and event rather than the
+    raw events, so cost follows the number of active users. The queries sit
+    behind the few methods below (day ranges are [start, end)), which
+    engines.columnar overrides to run the same computations on Parquet.
+    """
+    
     def __init__(self, db):
         self.db = db
     
+    async def _active_users(self, start: date, end: date) -> int:
+        """Distinct users active on any day in the range"""
+        result = await self.db.execute(
+            select(func.count(distinct(Activity.user_id)))
+            .where(and_(Activity.day >= start, Activity.day < end))
+        )
+        return result.scalar()
+    
+    async def _retained_users(self, cohort_day: date, day: date) -> int:
+        """Users active on cohort_day who are active again on day"""
+        # Cohort kept as a subquery so retained users are matched in the database
+        cohort_users = select(Activity.user_id).where(Activity.day == cohort_day)
+        result = await self.db.execute(
+            select(func.count(distinct(Activity.user_id)))
+            .where(and_(
+                Activity.user_id.in_(cohort_users),
+                Activity.day == day
+            ))
+        )
+        return result.scalar()
+    
+    async def _users_per_event(self, start: date, end: date) -> Dict[int, int]:
+        """Distinct users per event name key, in one grouped pass"""
+        result = await self.db.execute(
+            select(Activity.event_name_id, func.count(distinct(Activity.user_id)))
+            .where(and_(Activity.day >= start, Activity.day < end))
+            .group_by(Activity.event_name_id)
+        )
+        return dict(result.fetchall())
+    
+    async def _event_users(self, event_name_id: int, start: date, end: date) -> Set[int]:
+        """Keys of the users who sent an event in the range"""
+        result = await self.db.execute(
+            select(distinct(Activity.user_id))
+            .where(and_(
+                Activity.event_name_id == event_name_id,
+                Activity.day >= start,
+                Activity.day < end
+            ))
+        )
+        return {row[0] for row in result.fetchall()}
+    
+    async def _save(self, metric: Metric):
+        """Store a metric, replacing any value already computed for its (metric_name, date)"""
+        stmt = insert(Metric).values(
+            metric_name=metric.metric_name,
+            metric_type=metric.metric_type,
+            value=metric.value,
+            date=metric.date,
+            metadata=metric.metadata,
+            computed_at=datetime.utcnow()
+        )
+        await self.db.execute(stmt.on_conflict_do_update(
+            index_elements=["metric_name", "date"],
+            set_={
+                "metric_type": stmt.excluded.metric_type,
+                "value": stmt.excluded.value,
+                "metadata": stmt.excluded.metadata,
+                "computed_at": stmt.excluded.computed_at
+            }
+        ))
+    
     async def compute_dau(self):
         """Compute Daily Active Users"""
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         yesterday = today - timedelta(days=1)
         
         # Count distinct users for yesterday
-        result = await self.db.execute(
-            select(func.count(distinct(Event.user_id)))
-            .where(and_(
-                Event.timestamp >= yesterday,
-                Event.timestamp < today
-            ))
-        )
-        dau_count = result.scalar()
+        dau_count = await self._active_users(yesterday.date(), today.date())
         
         metric = Metric(
             metric_name="dau",
@@ -28,21 +94,14 @@ class MetricsEngine:
             date=yesterday,
             metadata={"period": "daily"}
         )
-        self.db.add(metric)
+        await self._save(metric)
     
     async def compute_wau(self):
         """Compute Weekly Active Users"""
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         week_ago = today - timedelta(days=7)
         
-        result = await self.db.execute(
-            select(func.count(distinct(Event.user_id)))
-            .where(and_(
-                Event.timestamp >= week_ago,
-                Event.timestamp < today
-            ))
-        )
-        wau_count = result.scalar()
+        wau_count = await self._active_users(week_ago.date(), today.date())
         
         metric = Metric(
             metric_name="wau",
@@ -51,21 +110,14 @@ class MetricsEngine:
             date=today,
             metadata={"period": "weekly"}
         )
-        self.db.add(metric)
+        await self._save(metric)
     
     async def compute_mau(self):
         """Compute Monthly Active Users"""
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         month_ago = today - timedelta(days=30)
         
-        result = await self.db.execute(
-            select(func.count(distinct(Event.user_id)))
-            .where(and_(
-                Event.timestamp >= month_ago,
-                Event.timestamp < today
-            ))
-        )
-        mau_count = result.scalar()
+        mau_count = await self._active_users(month_ago.date(), today.date())
         
         metric = Metric(
             metric_name="mau",
@@ -74,37 +126,21 @@ class MetricsEngine:
             date=today,
             metadata={"period": "monthly"}
         )
-        self.db.add(metric)
+        await self._save(metric)
     
     async def compute_retention(self):
         """Compute D1, D7, D30 retention"""
         cohort_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=30)
         
-        # Get cohort users
-        result = await self.db.execute(
-            select(distinct(Event.user_id))
-            .where(and_(
-                Event.timestamp >= cohort_date,
-                Event.timestamp < cohort_date + timedelta(days=1)
-            ))
-        )
-        cohort_users = {row[0] for row in result.fetchall()}
-        cohort_size = len(cohort_users)
+        # Get cohort size
+        cohort_size = await self._active_users(cohort_date.date(), cohort_date.date() + timedelta(days=1))
         
         if cohort_size == 0:
             return
         
         # D1 retention
         d1_date = cohort_date + timedelta(days=1)
-        result = await self.db.execute(
-            select(distinct(Event.user_id))
-            .where(and_(
-                Event.user_id.in_(cohort_users),
-                Event.timestamp >= d1_date,
-                Event.timestamp < d1_date + timedelta(days=1)
-            ))
-        )
-        d1_users = len(result.fetchall())
+        d1_users = await self._retained_users(cohort_date.date(), d1_date.date())
         d1_retention = (d1_users / cohort_size) * 100
         
         metric = Metric(
@@ -114,19 +150,11 @@ class MetricsEngine:
             date=cohort_date,
             metadata={"cohort_size": cohort_size, "retained_users": d1_users}
         )
-        self.db.add(metric)
+        await self._save(metric)
         
         # D7 retention
         d7_date = cohort_date + timedelta(days=7)
-        result = await self.db.execute(
-            select(distinct(Event.user_id))
-            .where(and_(
-                Event.user_id.in_(cohort_users),
-                Event.timestamp >= d7_date,
-                Event.timestamp < d7_date + timedelta(days=1)
-            ))
-        )
-        d7_users = len(result.fetchall())
+        d7_users = await self._retained_users(cohort_date.date(), d7_date.date())
         d7_retention = (d7_users / cohort_size) * 100
         
         metric = Metric(
@@ -136,19 +164,11 @@ class MetricsEngine:
             date=cohort_date,
             metadata={"cohort_size": cohort_size, "retained_users": d7_users}
         )
-        self.db.add(metric)
+        await self._save(metric)
         
         # D30 retention
         d30_date = cohort_date + timedelta(days=30)
-        result = await self.db.execute(
-            select(distinct(Event.user_id))
-            .where(and_(
-                Event.user_id.in_(cohort_users),
-                Event.timestamp >= d30_date,
-                Event.timestamp < d30_date + timedelta(days=1)
-            ))
-        )
-        d30_users = len(result.fetchall())
+        d30_users = await self._retained_users(cohort_date.date(), d30_date.date())
         d30_retention = (d30_users / cohort_size) * 100
         
         metric = Metric(
@@ -158,47 +178,25 @@ class MetricsEngine:
             date=cohort_date,
             metadata={"cohort_size": cohort_size, "retained_users": d30_users}
         )
-        self.db.add(metric)
+        await self._save(metric)
     
     async def compute_feature_adoption(self):
         """Compute feature adoption rates"""
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         week_ago = today - timedelta(days=7)
         
-        # Get all unique event names as features
-        result = await self.db.execute(
-            select(distinct(Event.event_name))
-            .where(and_(
-                Event.timestamp >= week_ago,
-                Event.timestamp < today
-            ))
-        )
-        features = [row[0] for row in result.fetchall()]
+        # Users per event; each event name is a feature
+        feature_counts = await self._users_per_event(week_ago.date(), today.date())
+        features = await event_names.names(feature_counts)
         
         # Get total users
-        result = await self.db.execute(
-            select(func.count(distinct(Event.user_id)))
-            .where(and_(
-                Event.timestamp >= week_ago,
-                Event.timestamp < today
-            ))
-        )
-        total_users = result.scalar()
+        total_users = await self._active_users(week_ago.date(), today.date())
         
         if total_users == 0:
             return
         
-        for feature in features:
-            # Count users who used this feature
-            result = await self.db.execute(
-                select(func.count(distinct(Event.user_id)))
-                .where(and_(
-                    Event.event_name == feature,
-                    Event.timestamp >= week_ago,
-                    Event.timestamp < today
-                ))
-            )
-            feature_users = result.scalar()
+        for feature_id, feature in features.items():
+            feature_users = feature_counts[feature_id]
             adoption_rate = (feature_users / total_users) * 100
             
             metric = Metric(
@@ -212,7 +210,7 @@ class MetricsEngine:
                     "total_users": total_users
                 }
             )
-            self.db.add(metric)
+            await self._save(metric)
     
     async def compute_funnels(self):
         """Compute conversion funnels"""
@@ -222,18 +220,14 @@ class MetricsEngine:
         # Example funnel: signup -> onboarding -> first_action
         funnel_steps = ["signup", "onboarding_complete", "first_action"]
         
-        # Get users at each step
+        # Get users at each step; a step never seen has no key and no users
+        step_ids = await event_names.lookup(funnel_steps)
         step_users = {}
         for step in funnel_steps:
-            result = await self.db.execute(
-                select(distinct(Event.user_id))
-                .where(and_(
-                    Event.event_name == step,
-                    Event.timestamp >= week_ago,
-                    Event.timestamp < today
-                ))
-            )
-            step_users[step] = {row[0] for row in result.fetchall()}
+            if step not in step_ids:
+                step_users[step] = set()
+                continue
+            step_users[step] = await self._event_users(step_ids[step], week_ago.date(), today.date())
         
         if len(step_users.get(funnel_steps[0], set())) == 0:
             return
@@ -262,4 +256,4 @@ class MetricsEngine:
                 "base_users": base_count
             }
         )
-        self.db.add(metric)
\ No newline at end of file
+        await self._save(metric)
\ No newline at end of file
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, distinct
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, List
 
-from database import get_db, Metric
+from database import get_read_db, Event, Metric
+from dimensions import event_names
+from properties import PROMOTED_PROPERTIES
 
 router = APIRouter()
 
@@ -12,7 +14,7 @@ router = APIRouter()
 async def get_dau(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Metric).where(Metric.metric_name == "dau")
     
@@ -39,7 +41,7 @@ async def get_dau(
 @router.get("/retention")
 async def get_retention(
     cohort_date: Optional[str] = Query(None),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Metric).where(Metric.metric_type == "retention")
     
@@ -65,12 +67,13 @@ async def get_retention(
 @router.get("/feature-adoption")
 async def get_feature_adoption(
     feature: Optional[str] = Query(None),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Metric).where(Metric.metric_type == "feature_adoption")
     
     if feature:
-        query = query.where(Metric.metadata["feature"].astext == feature)
+        # Containment rather than ->> so the GIN index on metadata applies
+        query = query.where(Metric.metadata.contains({"feature": feature}))
     
     query = query.order_by(Metric.date.desc()).limit(50)
     result = await db.execute(query)
@@ -91,7 +94,7 @@ async def get_feature_adoption(
 @router.get("/funnel")
 async def get_funnel(
     funnel_name: str = Query(...),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Metric).where(
         and_(
@@ -118,7 +121,7 @@ async def get_funnel(
 async def get_all_metrics(
     metric_type: Optional[str] = Query(None),
     limit: int = Query(100),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     query = select(Metric)
     
@@ -142,4 +145,72 @@ async def get_all_metrics(
             }
             for m in metrics
         ]
+    }
+
+def _property_column(key: str):
+    """Typed column for a promoted property, else the text value from properties"""
+    promoted = PROMOTED_PROPERTIES.get(key)
+    if promoted:
+        return getattr(Event, promoted.column)
+    return Event.properties[key].astext
+
+def _property_filter(key: str, value: str):
+    promoted = PROMOTED_PROPERTIES.get(key)
+    if promoted:
+        try:
+            return getattr(Event, promoted.column) == promoted.parse(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid {promoted.kind} value for {key}: {value}")
+    # Non-promoted properties match string values through the GIN index on properties
+    return Event.properties.contains({key: value})
+
+@router.get("/breakdown")
+async def get_breakdown(
+    event_name: str = Query(...),
+    property: str = Query(...),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    filters: List[str] = Query([], alias="filter", description="property=value, repeatable"),
+    limit: int = Query(50),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Events and users per value of a property for one event, e.g. signups by plan"""
+    end = datetime.fromisoformat(end_date) if end_date else datetime.utcnow()
+    start = datetime.fromisoformat(start_date) if start_date else end - timedelta(days=7)
+    
+    conditions = []
+    for f in filters:
+        key, sep, value = f.partition("=")
+        if not sep:
+            raise HTTPException(status_code=400, detail=f"Filter must be property=value: {f}")
+        conditions.append(_property_filter(key, value))
+    
+    event_ids = await event_names.lookup([event_name])
+    if event_name not in event_ids:
+        return {"event_name": event_name, "property": property, "breakdown": []}
+    
+    group = _property_column(property).label("property_value")
+    query = select(
+        group,
+        func.count().label("events"),
+        func.count(distinct(Event.user_id)).label("users")
+    ).where(and_(
+        Event.event_name_id == event_ids[event_name],
+        Event.timestamp >= start,
+        Event.timestamp < end,
+        *conditions
+    )).group_by(group).order_by(func.count().desc()).limit(limit)
+    
+    result = await db.execute(query)
+    
+    return {
+        "event_name": event_name,
+        "property": property,
+        "promoted": property in PROMOTED_PROPERTIES,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "breakdown": [
+            {"value": row.property_value, "events": row.events, "users": row.users}
+            for row in result.all()
+        ]
     }
\ No newline at end of file
@@ -1,7 +1,15 @@
-import httpx
 import base64
+import json
 from datetime import datetime
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
+
+from transport import get_http_client
+from integrations.hashing import user_id_hasher
+from integrations.ratelimit import get_limiter
+from batch import EventBatch, PropertyFilter
+
+# Mixpanel-internal ($-prefixed) properties and the fields we store as columns
+_property_filter = PropertyFilter(drop_prefix="$", drop_keys=("time", "distinct_id"))
 
 class MixpanelClient:
     def __init__(self, api_key: str, api_secret: str):
@@ -17,49 +25,53 @@ class MixpanelClient:
     
     async def fetch_events(self, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Fetch events from Mixpanel Export API"""
-        events = []
+        events = EventBatch()
+        async for batch in self.stream_events(start_date, end_date):
+            events.extend(batch)
+        return events.to_events()
+    
+    async def stream_events(
+        self, start_date: datetime, end_date: datetime, batch_size: int = 5000
+    ) -> AsyncIterator[EventBatch]:
+        """Stream the export line by line and yield normalized events in batches"""
+        client = get_http_client()
+        params = {
+            "from_date": start_date.strftime("%Y-%m-%d"),
+            "to_date": end_date.strftime("%Y-%m-%d")
+        }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            params = {
-                "from_date": start_date.strftime("%Y-%m-%d"),
-                "to_date": end_date.strftime("%Y-%m-%d")
-            }
-            
-            try:
-                response = await client.get(
-                    f"{self.base_url}/export",
-                    params=params,
-                    headers={"Authorization": self.auth_header}
-                )
-                response.raise_for_status()
+        async with get_limiter("mixpanel").stream(
+            client,
+            "GET",
+            f"{self.base_url}/export",
+            params=params,
+            headers={"Authorization": self.auth_header}
+        ) as response:
+            # Mixpanel returns JSONL (one JSON object per line)
+            raw_events = []
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
                 
-                # Mixpanel returns JSONL (one JSON object per line)
-                for line in response.text.strip().split('\n'):
-                    if not line:
-                        continue
-                    
-                    import json
-                    event_data = json.loads(line)
-                    
-                    # Normalize to our schema
-                    normalized = {
-                        "user_id": self._hash_user_id(event_data["properties"].get("distinct_id")),
-                        "session_id": event_data["properties"].get("$session_id"),
-                        "event_name": event_data["event"],
-                        "timestamp": datetime.fromtimestamp(event_data["properties"]["time"]),
-                        "properties": {
-                            k: v for k, v in event_data["properties"].items()
-                            if not k.startswith("$") and k not in ["time", "distinct_id"]
-                        }
-                    }
-                    events.append(normalized)
-                
-            except Exception as e:
-                print(f"Mixpanel fetch error: {e}")
-        
-        return events
+                raw_events.append(json.loads(line))
+                if len(raw_events) >= batch_size:
+                    yield self.normalize_batch(raw_events)
+                    raw_events = []
+            
+            if raw_events:
+                yield self.normalize_batch(raw_events)
     
-    def _hash_user_id(self, user_id: str) -> str:
-        """Hash user ID for privacy"""
-        import hashlib
-        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
\ No newline at end of file
+    @classmethod
+    def normalize_batch(cls, raw_events: List[Dict]) -> EventBatch:
+        """Normalize a page of export records column by column, hashing its user ids in one pass.
+        
+        Needs no credentials, so the offline importer reuses it on export files.
+        """
+        properties = [e["properties"] for e in raw_events]
+        return EventBatch(
+            user_id=user_id_hasher.hash_many(p.get("distinct_id") for p in properties),
+            session_id=[p.get("$session_id") for p in properties],
+            event_name=[e["event"] for e in raw_events],
+            timestamp=[datetime.fromtimestamp(p["time"]) for p in properties],
+            properties=_property_filter(properties)
+        )
\ No newline at end of file
@@ -0,0 +1,283 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from batch import event_dedup_key, identity_json
+
+EVENTS_TABLE = "events"
+EVENTS_PARTITION_INTERVAL = os.getenv("EVENTS_PARTITION_INTERVAL", "month")
+EVENTS_PARTITIONS_AHEAD = int(os.getenv("EVENTS_PARTITIONS_AHEAD", "3"))
+# 0 keeps events forever
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "0"))
+# "drop" deletes expired partitions, "detach" keeps them as standalone tables for archiving
+EVENTS_RETENTION_MODE = os.getenv("EVENTS_RETENTION_MODE", "drop")
+# Writers reject events older than this when EVENTS_RETENTION_DAYS is 0
+EVENTS_EARLIEST_TIMESTAMP = os.getenv("EVENTS_EARLIEST_TIMESTAMP", "2000-01-01")
+
+# Legacy rows given dedup keys per round trip during the copy
+LEGACY_KEY_BATCH = 10000
+# Per dimension: legacy string column, integer key column, dimension table and its string column
+LEGACY_DIMENSIONS = (
+    ("source", "source_id", "sources", "name"),
+    ("user_id", "user_id", "users", "external_id"),
+    ("event_name", "event_name_id", "event_names", "name"),
+)
+
+# Partitions this process has already created or seen, so writers skip the catalog lookup
+_known_partitions: Set[str] = set()
+
+def partition_start(day: date, interval: str = EVENTS_PARTITION_INTERVAL) -> date:
+    if interval == "day":
+        return day
+    return day.replace(day=1)
+
+def next_partition_start(start: date, interval: str = EVENTS_PARTITION_INTERVAL) -> date:
+    if interval == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(start: date, interval: str = EVENTS_PARTITION_INTERVAL) -> str:
+    if interval == "day":
+        return f"{EVENTS_TABLE}_p{start:%Y%m%d}"
+    return f"{EVENTS_TABLE}_p{start:%Y%m}"
+
+def partition_starts(timestamps: Iterable[datetime], interval: str = EVENTS_PARTITION_INTERVAL) -> List[date]:
+    """Distinct starts of the partitions holding these timestamps, oldest first"""
+    return sorted({partition_start(ts.date(), interval) for ts in timestamps})
+
+def timestamp_window(now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """[earliest, latest) event timestamps writers accept.
+    
+    The window runs from the retention horizon (or EVENTS_EARLIEST_TIMESTAMP
+    when events are kept forever) to the end of the last partition kept
+    ahead, so a bogus timestamp can't make a writer create partitions
+    that retention would drop straight away or that sit years in the future.
+    """
+    now = now or datetime.utcnow()
+    if EVENTS_RETENTION_DAYS > 0:
+        earliest = now - timedelta(days=EVENTS_RETENTION_DAYS)
+    else:
+        earliest = datetime.fromisoformat(EVENTS_EARLIEST_TIMESTAMP)
+    end = next_partition_start(partition_start(now.date()))
+    for _ in range(EVENTS_PARTITIONS_AHEAD):
+        end = next_partition_start(end)
+    return earliest, datetime.combine(end, datetime.min.time())
+
+async def ensure_partitions(conn: AsyncConnection, starts: Iterable[date]) -> List[str]:
+    """Create any missing events partitions starting at starts; returns the ones created.
+    
+    Creating a partition locks the parent table, so the regular path is the
+    maintenance job creating them ahead of time; writers only pay for this
+    when a batch reaches outside that window (old backfills, clock skew).
+    """
+    created = []
+    for start in sorted(set(starts)):
+        name = partition_name(start)
+        if name in _known_partitions:
+            continue
+        exists = await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+        if exists:
+            _known_partitions.add(name)
+        else:
+            # Not cached until seen again: the caller's transaction may still roll back
+            end = next_partition_start(start)
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {EVENTS_TABLE} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+async def create_partitions(engine: AsyncEngine, conn: AsyncConnection, starts: Iterable[date]) -> List[str]:
+    """Create missing partitions before a write on conn, committing them on their own.
+    
+    The CREATE runs in a short transaction on a separate connection, so the
+    lock on the parent table isn't held for the writer's whole transaction.
+    Once that transaction has written events it holds a lock the CREATE
+    would wait on forever, so then it runs on conn instead.
+    """
+    missing = [start for start in set(starts) if partition_name(start) not in _known_partitions]
+    if not missing:
+        return []
+    holds_lock = await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE pid = pg_backend_pid() AND relation = to_regclass(:name))"
+    ), {"name": EVENTS_TABLE})
+    if holds_lock:
+        return await ensure_partitions(conn, missing)
+    async with engine.begin() as own:
+        created = await ensure_partitions(own, missing)
+    _known_partitions.update(partition_name(start) for start in missing)
+    return created
+
+async def ensure_partitions_ahead(conn: AsyncConnection, now: Optional[datetime] = None) -> List[str]:
+    """Create the current partition and the next EVENTS_PARTITIONS_AHEAD ones"""
+    starts = [partition_start((now or datetime.utcnow()).date())]
+    for _ in range(EVENTS_PARTITIONS_AHEAD):
+        starts.append(next_partition_start(starts[-1]))
+    return await ensure_partitions(conn, starts)
+
+async def list_partitions(conn: AsyncConnection) -> List[Dict]:
+    """Attached events partitions with their bounds, oldest first"""
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:parent AS regclass) ORDER BY c.relname"
+    ), {"parent": EVENTS_TABLE})
+    partitions = []
+    for name, bound in result.all():
+        # FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-02-01 00:00:00')
+        parts = bound.split("'")
+        if len(parts) < 4:
+            continue
+        partitions.append({
+            "name": name,
+            "start": datetime.fromisoformat(parts[1]),
+            "end": datetime.fromisoformat(parts[3])
+        })
+    return partitions
+
+async def apply_retention(
+    conn: AsyncConnection,
+    retention_days: int = EVENTS_RETENTION_DAYS,
+    mode: str = EVENTS_RETENTION_MODE,
+    now: Optional[datetime] = None
+) -> List[str]:
+    """Detach (and by default drop) partitions whose whole range is past retention"""
+    if retention_days <= 0:
+        return []
+    
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    expired = []
+    for partition in await list_partitions(conn):
+        if partition["end"] > cutoff:
+            continue
+        await remove_partition(conn, partition["name"], mode)
+        expired.append(partition["name"])
+    return expired
+
+async def remove_partition(conn: AsyncConnection, name: str, mode: str = "drop"):
+    """Detach an events partition and, unless mode is "detach", drop it"""
+    await conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} DETACH PARTITION {name}"))
+    if mode == "drop":
+        await conn.execute(text(f"DROP TABLE {name}"))
+    _known_partitions.discard(name)
+
+async def _is_legacy_events(conn: AsyncConnection) -> bool:
+    """An events table from before integer dimension keys, still storing source, user and event name strings"""
+    string_dimensions = await conn.scalar(text(
+        "SELECT count(*) FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :name "
+        "AND column_name IN ('source', 'user_id', 'event_name') "
+        "AND data_type IN ('character varying', 'text')"
+    ), {"name": EVENTS_TABLE})
+    return bool(string_dimensions)
+
+async def retire_legacy_events(conn: AsyncConnection) -> Optional[str]:
+    """Rename an older events table (its partitions and indexes too) out of the way.
+    
+    create_all can then create the current table under the original names;
+    copy_legacy_events moves the rows over.
+    """
+    if not await _is_legacy_events(conn):
+        return None
+    
+    legacy = f"{EVENTS_TABLE}_legacy"
+    for partition in await list_partitions(conn):
+        await conn.execute(text(f"ALTER TABLE {partition['name']} RENAME TO {partition['name']}_legacy"))
+    indexes = await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :name"
+    ), {"name": EVENTS_TABLE})
+    for (index,) in indexes.all():
+        await conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}_legacy"))
+    await conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} RENAME TO {legacy}"))
+    return legacy
+
+async def _legacy_dimensions(conn: AsyncConnection, legacy: str) -> List[Dict]:
+    """How to read each dimension of the legacy table, whichever of its string or key column it has"""
+    result = await conn.execute(text(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :name"
+    ), {"name": legacy})
+    columns = dict(result.all())
+    dimensions = []
+    for alias, (string_column, key_column, table, name_column) in zip(("s", "u", "n"), LEGACY_DIMENSIONS):
+        if columns.get(string_column) in ("character varying", "text"):
+            dimensions.append({
+                "string_column": string_column, "table": table, "name_column": name_column,
+                "value": f"l.{string_column}", "key": f"{alias}.id",
+                "join": f"JOIN {table} {alias} ON {alias}.{name_column} = l.{string_column}"
+            })
+        else:
+            dimensions.append({
+                "string_column": None, "table": table, "name_column": name_column,
+                "value": f"{alias}.{name_column}", "key": f"l.{key_column}",
+                "join": f"JOIN {table} {alias} ON {alias}.id = l.{key_column}"
+            })
+    return dimensions
+
+async def _fill_legacy_dedup_keys(conn: AsyncConnection, legacy: str, dimensions: List[Dict]) -> int:
+    """Give legacy rows written before dedup keys existed the key the writer would compute.
+    
+    Without it the first sync after the upgrade re-inserts its whole lookback.
+    """
+    if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {legacy} WHERE dedup_key IS NULL)")):
+        return 0
+    
+    # Dimensions stored as keys are read back as strings, the way the writer sees them
+    values = ", ".join(d["value"] for d in dimensions)
+    joins = " ".join(d["join"] for d in dimensions if not d["string_column"])
+    filled, last_id = 0, 0
+    while True:
+        result = await conn.execute(text(
+            f"SELECT l.id, {values}, l.session_id, l.timestamp, CAST(l.properties AS text) FROM {legacy} l {joins} "
+            f"WHERE l.dedup_key IS NULL AND l.id > :last_id ORDER BY l.id LIMIT :batch"
+        ), {"last_id": last_id, "batch": LEGACY_KEY_BATCH})
+        rows = result.all()
+        if not rows:
+            return filled
+        keys = []
+        for id, source, user_id, event_name, session_id, timestamp, properties in rows:
+            properties = json.loads(properties) if properties else {}
+            properties_json = json.dumps(properties, sort_keys=True, default=str)
+            keys.append({
+                "id": id,
+                "dedup_key": event_dedup_key(source, user_id, event_name, timestamp, identity_json(source, properties, properties_json, session_id))
+            })
+        await conn.execute(text(f"UPDATE {legacy} SET dedup_key = :dedup_key WHERE id = :id"), keys)
+        filled += len(keys)
+        last_id = rows[-1][0]
+
+async def copy_legacy_events(conn: AsyncConnection, legacy: str):
+    """Copy rows from the retired table, encoding dimension strings into keys, then drop it"""
+    unit = "day" if EVENTS_PARTITION_INTERVAL == "day" else "month"
+    result = await conn.execute(text(f"SELECT DISTINCT date_trunc('{unit}', timestamp) FROM {legacy}"))
+    starts = [partition_start(start.date()) for (start,) in result.all() if start is not None]
+    if starts:
+        await ensure_partitions(conn, starts)
+        dimensions = await _legacy_dimensions(conn, legacy)
+        filled = await _fill_legacy_dedup_keys(conn, legacy, dimensions)
+        if filled:
+            print(f"Computed dedup keys for {filled} legacy events")
+        for d in dimensions:
+            if d["string_column"]:
+                await conn.execute(text(
+                    f"INSERT INTO {d['table']} ({d['name_column']}) "
+                    f"SELECT DISTINCT {d['string_column']} FROM {legacy} ON CONFLICT DO NOTHING"
+                ))
+        source, user, event_name = (d["key"] for d in dimensions)
+        joins = " ".join(d["join"] for d in dimensions if d["string_column"])
+        await conn.execute(text(
+            f"INSERT INTO {EVENTS_TABLE} "
+            f"(id, user_id, session_id, event_name_id, timestamp, source_id, properties, created_at, dedup_key) "
+            f"SELECT l.id, {user}, l.session_id, {event_name}, l.timestamp, {source}, l.properties::jsonb, l.created_at, l.dedup_key "
+            f"FROM {legacy} l {joins} "
+            f"ON CONFLICT DO NOTHING"
+        ))
+        await conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{EVENTS_TABLE}', 'id'), (SELECT max(id) FROM {legacy}))"
+        ))
+    await conn.execute(text(f"DROP TABLE {legacy}"))
\ No newline at end of file
@@ -1,59 +1,107 @@
 import httpx
-from datetime import datetime
-from typing import List, Dict
-import hashlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Dict, Tuple
+
+from transport import get_http_client
+from integrations.hashing import user_id_hasher
+from integrations.ratelimit import get_limiter
+from batch import EventBatch, PropertyFilter, merge_pages
+
+# PostHog-internal properties are $-prefixed
+_property_filter = PropertyFilter(drop_prefix="$")
 
 class PostHogClient:
-    def __init__(self, api_key: str, project_id: str, host: str = "https://app.posthog.com"):
+    def __init__(
+        self,
+        api_key: str,
+        project_id: str,
+        host: str = "https://app.posthog.com",
+        page_size: int = 1000,
+        slice_hours: int = 6,
+        concurrency: int = 4
+    ):
         self.api_key = api_key
         self.project_id = project_id
         self.host = host
+        self.page_size = page_size
+        self.slice_hours = slice_hours
+        self.concurrency = concurrency
     
     async def fetch_events(self, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Fetch events from PostHog API"""
-        events = []
+        events = EventBatch()
+        async for batch in self.stream_events(start_date, end_date):
+            events.extend(batch)
+        return events.to_events()
+    
+    async def stream_events(self, start_date: datetime, end_date: datetime) -> AsyncIterator[EventBatch]:
+        """Fetch time slices concurrently, following each slice's pages, and yield pages as they land"""
+        client = get_http_client()
+        
+        async def slice_pages(after: datetime, before: datetime) -> AsyncIterator[EventBatch]:
+            offset = 0
+            while True:
+                data = await self._query_page(client, after, before, offset)
+                rows = data.get("results", [])
+                if rows:
+                    yield self._normalize_batch(rows)
+                if not data.get("hasMore") or not rows:
+                    break
+                offset += len(rows)
+        
+        # A slice that exhausted its retries fails the whole fetch
+        slices = [slice_pages(after, before) for after, before in self._slices(start_date, end_date)]
+        async for page in merge_pages(slices, self.concurrency):
+            yield page
+    
+    def _slices(self, start_date: datetime, end_date: datetime) -> List[Tuple[datetime, datetime]]:
+        """Split [start_date, end_date) into fixed-width time slices"""
+        slices = []
+        step = timedelta(hours=self.slice_hours)
+        after = start_date
+        while after < end_date:
+            before = min(after + step, end_date)
+            slices.append((after, before))
+            after = before
+        return slices
+    
+    async def _query_page(
+        self, client: httpx.AsyncClient, after: datetime, before: datetime, offset: int
+    ) -> Dict:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            try:
-                # PostHog uses query API
-                query = {
-                    "kind": "EventsQuery",
-                    "select": ["*"],
-                    "after": start_date.isoformat(),
-                    "before": end_date.isoformat()
-                }
-                
-                response = await client.post(
-                    f"{self.host}/api/projects/{self.project_id}/query",
-                    json=query,
-                    headers=headers
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                for event_data in data.get("results", []):
-                    normalized = {
-                        "user_id": self._hash_user_id(event_data.get("distinct_id", "")),
-                        "session_id": event_data.get("properties", {}).get("$session_id"),
-                        "event_name": event_data["event"],
-                        "timestamp": datetime.fromisoformat(event_data["timestamp"].replace("Z", "+00:00")),
-                        "properties": {
-                            k: v for k, v in event_data.get("properties", {}).items()
-                            if not k.startswith("$")
-                        }
-                    }
-                    events.append(normalized)
-                
-            except Exception as e:
-                print(f"PostHog fetch error: {e}")
+        # PostHog uses query API; hasMore/offset is the page cursor
+        query = {
+            "kind": "EventsQuery",
+            "select": ["*"],
+            "after": after.isoformat(),
+            "before": before.isoformat(),
+            "orderBy": ["timestamp ASC"],
+            "limit": self.page_size,
+            "offset": offset
+        }
         
-        return events
+        response = await get_limiter("posthog").request(
+            client,
+            "POST",
+            f"{self.host}/api/projects/{self.project_id}/query",
+            json={"query": query},
+            headers=headers
+        )
+        return response.json()
     
-    def _hash_user_id(self, user_id: str) -> str:
-        return hashlib.sha256(user_id.encode()).hexdigest()[:16]
\ No newline at end of file
+    def _normalize_batch(self, rows: List) -> EventBatch:
+        """Normalize a page of query rows column by column, hashing its user ids in one pass"""
+        # select ["*"] returns each row as a single-column list
+        raw_events = [row[0] if isinstance(row, list) else row for row in rows]
+        properties = [e.get("properties", {}) for e in raw_events]
+        return EventBatch(
+            user_id=user_id_hasher.hash_many(e.get("distinct_id", "") for e in raw_events),
+            session_id=[p.get("$session_id") for p in properties],
+            event_name=[e["event"] for e in raw_events],
+            timestamp=[datetime.fromisoformat(e["timestamp"].replace("Z", "+00:00")) for e in raw_events],
+            properties=_property_filter(properties)
+        )
\ No newline at end of file
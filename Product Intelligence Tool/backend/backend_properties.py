@@ -0,0 +1,171 @@
+import json
+import os
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import BigInteger, Boolean, Float, String, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from partitions import list_partitions
+
+# Comma-separated event properties stored as their own indexed columns,
+# e.g. "plan,country,amount:float,seats:int,trial:bool"; untyped ones are strings
+PROMOTED_EVENT_PROPERTIES = os.getenv("PROMOTED_EVENT_PROPERTIES", "")
+
+PROPERTY_TYPES = {"string": String, "int": BigInteger, "float": Float, "bool": Boolean}
+SQL_TYPES = {"string": "VARCHAR", "int": "BIGINT", "float": "DOUBLE PRECISION", "bool": "BOOLEAN"}
+
+# Sync state row listing promoted properties still to be filled for existing events
+PROMOTED_BACKFILL_STATE = "promoted_backfill"
+
+class PromotedProperty:
+    """An event property copied out of the JSONB properties into a typed column.
+    
+    Values that don't fit the type are stored as NULL in the column and stay
+    untouched in properties, so promoting never loses data.
+    """
+    
+    def __init__(self, key: str, kind: str = "string"):
+        if kind not in PROPERTY_TYPES:
+            raise ValueError(f"Unknown type '{kind}' for promoted property '{key}'")
+        self.key = key
+        self.kind = kind
+        self.column = "prop_" + re.sub(r"[^a-z0-9_]", "_", key.lower())
+    
+    def coerce(self, value: Any) -> Any:
+        """Column value for a property value, mirroring sql_expression"""
+        if value is None:
+            return None
+        if self.kind == "string":
+            return value if isinstance(value, str) else json.dumps(value, default=str)
+        if self.kind == "bool":
+            return value if isinstance(value, bool) else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if self.kind == "int":
+            return value if isinstance(value, int) and -2 ** 63 <= value < 2 ** 63 else None
+        return float(value)
+    
+    def parse(self, value: str) -> Any:
+        """Column value from a query string parameter"""
+        if self.kind == "int":
+            return int(value)
+        if self.kind == "float":
+            return float(value)
+        if self.kind == "bool":
+            return value.lower() in ("true", "1", "yes")
+        return value
+    
+    def sql_expression(self, column: str = "properties") -> str:
+        """SQL extracting this property from a JSONB column, for backfilling existing rows"""
+        key = self.key.replace("'", "''")
+        value = f"{column} -> '{key}'"
+        if self.kind == "string":
+            return f"{column} ->> '{key}'"
+        if self.kind == "bool":
+            return f"CASE WHEN jsonb_typeof({value}) = 'boolean' THEN ({value})::boolean END"
+        if self.kind == "int":
+            return f"CASE WHEN jsonb_typeof({value}) = 'number' AND ({column} ->> '{key}') ~ '^-?[0-9]+$' THEN ({value})::bigint END"
+        return f"CASE WHEN jsonb_typeof({value}) = 'number' THEN ({value})::double precision END"
+
+def parse_promoted(spec: str) -> Dict[str, PromotedProperty]:
+    promoted = {}
+    columns = set()
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key, _, kind = entry.partition(":")
+        prop = PromotedProperty(key.strip(), kind.strip() or "string")
+        if prop.column in columns:
+            raise ValueError(f"Promoted property '{prop.key}' collides with another on column {prop.column}")
+        columns.add(prop.column)
+        promoted[prop.key] = prop
+    return promoted
+
+PROMOTED_PROPERTIES = parse_promoted(PROMOTED_EVENT_PROPERTIES)
+
+def extract_promoted(properties: List[Dict]) -> Dict[str, list]:
+    """Promoted column values for a list of property dicts, keyed by column name"""
+    return {
+        prop.column: [prop.coerce(p.get(prop.key)) for p in properties]
+        for prop in PROMOTED_PROPERTIES.values()
+    }
+
+async def add_promoted_columns(conn: AsyncConnection, table: str = "events") -> List[PromotedProperty]:
+    """Add columns for newly configured promoted properties; returns the ones added"""
+    result = await conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :name"
+    ), {"name": table})
+    existing = {row[0] for row in result.all()}
+    added = []
+    for prop in PROMOTED_PROPERTIES.values():
+        if prop.column in existing:
+            continue
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {prop.column} {SQL_TYPES[prop.kind]}"))
+        added.append(prop)
+    return added
+
+async def _backfill_state(conn: AsyncConnection) -> Dict:
+    value = await conn.scalar(
+        text("SELECT CAST(metadata AS text) FROM sync_state WHERE source = :source"),
+        {"source": PROMOTED_BACKFILL_STATE}
+    )
+    return json.loads(value) if value else {}
+
+async def _save_backfill_state(conn: AsyncConnection, pending: List[str], done: List[str]):
+    await conn.execute(text(
+        "INSERT INTO sync_state (source, status, metadata) VALUES (:source, :status, CAST(:metadata AS json)) "
+        "ON CONFLICT (source) DO UPDATE SET status = EXCLUDED.status, metadata = EXCLUDED.metadata"
+    ), {
+        "source": PROMOTED_BACKFILL_STATE,
+        "status": "pending" if pending else "success",
+        "metadata": json.dumps({"pending": pending, "done": done})
+    })
+
+async def queue_promoted_backfill(conn: AsyncConnection, promoted: List[PromotedProperty]):
+    """Record promoted properties whose columns need filling for existing rows; backfill_promoted does the work"""
+    if not promoted:
+        return
+    state = await _backfill_state(conn)
+    pending = sorted(set(state.get("pending", [])) | {prop.key for prop in promoted})
+    # Partitions already done lack the new columns, so every partition is revisited
+    await _save_backfill_state(conn, pending, [])
+
+async def backfill_promoted(engine: AsyncEngine) -> int:
+    """Fill queued promoted columns from properties, one events partition per transaction.
+    
+    Only rows holding one of the keys are updated. Progress is committed
+    with each partition, so a restart resumes where the last run stopped.
+    """
+    async with engine.connect() as conn:
+        state = await _backfill_state(conn)
+        partitions = [partition["name"] for partition in await list_partitions(conn)]
+    pending = state.get("pending", [])
+    if not pending:
+        return 0
+    
+    # Keys no longer configured are dropped from the queue without work
+    promoted = [PROMOTED_PROPERTIES[key] for key in pending if key in PROMOTED_PROPERTIES]
+    keys = [prop.key for prop in promoted]
+    assignments = ", ".join(f"{prop.column} = {prop.sql_expression()}" for prop in promoted)
+    done = state.get("done", [])
+    updated = 0
+    for name in partitions if promoted else []:
+        if name in done:
+            continue
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"UPDATE {name} SET {assignments} WHERE properties ?| CAST(:keys AS text[])"),
+                {"keys": keys}
+            )
+            done.append(name)
+            await _save_backfill_state(conn, pending, done)
+        updated += result.rowcount
+    
+    async with engine.begin() as conn:
+        await _save_backfill_state(conn, [], [])
+    if promoted:
+        print(f"Backfilled promoted properties {keys} on {updated} events")
+    return updated
\ No newline at end of file
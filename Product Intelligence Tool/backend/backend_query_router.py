@@ -4,7 +4,7 @@ from sqlalchemy import select, and_, func
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 
-from database import get_db, Event, Metric, Insight
+from database import get_read_db, Event, Metric, Insight
 from llm.client import LLMClient
 
 router = APIRouter()
@@ -15,7 +15,7 @@ class QueryRequest(BaseModel):
 @router.post("/ask")
 async def ask_question(
     request: QueryRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Get recent metrics
     result = await db.execute(
@@ -62,7 +62,7 @@ async def ask_question(
 @router.post("/analyze")
 async def analyze_metric(
     metric_name: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Get metric history
     result = await db.execute(
@@ -77,7 +77,7 @@ async def analyze_metric(
     # Get related insights
     result = await db.execute(
         select(Insight).where(
-            Insight.data["metric_name"].astext == metric_name
+            Insight.data.contains({"metric_name": metric_name})
         ).order_by(Insight.detected_at.desc()).limit(10)
     )
     insights = result.scalars().all()
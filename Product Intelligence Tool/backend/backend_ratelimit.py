@@ -0,0 +1,241 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+CONNECTOR_MAX_RETRIES = int(os.getenv("CONNECTOR_MAX_RETRIES", "5"))
+CONNECTOR_BACKOFF_BASE = float(os.getenv("CONNECTOR_BACKOFF_BASE", "1.0"))
+CONNECTOR_BACKOFF_MAX = float(os.getenv("CONNECTOR_BACKOFF_MAX", "60"))
+CONNECTOR_INITIAL_CONCURRENCY = float(os.getenv("CONNECTOR_INITIAL_CONCURRENCY", "4"))
+CONNECTOR_MAX_CONCURRENCY = float(os.getenv("CONNECTOR_MAX_CONCURRENCY", "16"))
+
+# Transient server-side failures worth another attempt
+RETRY_STATUSES = {500, 502, 503, 504}
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+class SourceLimiter:
+    """Retry and adaptive concurrency for one source's vendor API.
+    
+    Requests run inside a concurrency window sized with AIMD: each success
+    grows the window by 1/window (about one slot per round trip) and a 429
+    halves it, at most once per window so a burst of 429s from requests
+    already in flight counts as one signal. A Retry-After pauses every new
+    request for the source until it elapses. Other failures back off
+    exponentially with full jitter, and after max_retries the last error is
+    raised so the sync is marked failed instead of silently partial.
+    """
+    
+    def __init__(
+        self,
+        source: str,
+        initial: float = CONNECTOR_INITIAL_CONCURRENCY,
+        max_limit: float = CONNECTOR_MAX_CONCURRENCY,
+        max_retries: int = CONNECTOR_MAX_RETRIES,
+        backoff_base: float = CONNECTOR_BACKOFF_BASE,
+        backoff_max: float = CONNECTOR_BACKOFF_MAX
+    ):
+        self.source = source
+        self.limit = float(initial)
+        self.max_limit = float(max_limit)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = asyncio.Condition()
+        self._in_flight = 0
+        self._epoch = 0
+        self._paused_until = 0.0
+        self.requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.transport_errors = 0
+        self.retries = 0
+        self.failures = 0
+        self.backoff_seconds = 0.0
+        self.last_retry_after: Optional[float] = None
+        self.last_throttled_at: Optional[datetime] = None
+    
+    async def _acquire(self) -> int:
+        """Wait for a free slot (and any Retry-After pause); returns the window epoch"""
+        async with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self._in_flight < max(int(self.limit), 1):
+                    break
+                await self._cond.wait()
+            self._in_flight += 1
+            self.requests += 1
+            return self._epoch
+    
+    async def _release(self):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+    
+    def _on_success(self):
+        self.successes += 1
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+    
+    def _on_throttle(self, epoch: int, retry_after: Optional[float]):
+        self.throttled += 1
+        self.last_throttled_at = datetime.utcnow()
+        self.last_retry_after = retry_after
+        if epoch == self._epoch:
+            self.limit = max(1.0, self.limit / 2)
+            self._epoch += 1
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+    
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    async def _sleep(self, seconds: float):
+        self.retries += 1
+        self.backoff_seconds += seconds
+        await asyncio.sleep(seconds)
+    
+    async def _send(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send until a non-retryable response; the caller must close it and release the slot"""
+        auth = kwargs.pop("auth", httpx.USE_CLIENT_DEFAULT)
+        for attempt in range(self.max_retries + 1):
+            epoch = await self._acquire()
+            try:
+                request = client.build_request(method, url, **kwargs)
+                response = await client.send(request, auth=auth, stream=True)
+            except httpx.TransportError:
+                await self._release()
+                self.transport_errors += 1
+                if attempt == self.max_retries:
+                    self.failures += 1
+                    raise
+                await self._sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                await self._release()
+                raise
+            
+            if response.status_code != 429 and response.status_code not in RETRY_STATUSES:
+                return response
+            
+            await response.aclose()
+            await self._release()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                self._on_throttle(epoch, retry_after)
+            else:
+                self.server_errors += 1
+            if attempt == self.max_retries:
+                self.failures += 1
+                response.raise_for_status()
+            # Retry-After already pauses new requests; the jitter spreads the restart
+            await self._sleep(self._backoff(attempt))
+    
+    @asynccontextmanager
+    async def stream(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Streaming request; retries happen before the body is read, never mid-stream"""
+        response = await self._send(client, method, url, **kwargs)
+        try:
+            if response.is_error:
+                self.failures += 1
+                await response.aread()
+                response.raise_for_status()
+            self._on_success()
+            yield response
+        finally:
+            await response.aclose()
+            await self._release()
+    
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """Buffered request that raises on any non-2xx response once retries run out"""
+        async with self.stream(client, method, url, **kwargs) as response:
+            await response.aread()
+        return response
+    
+    async def call(
+        self,
+        fn: Callable[..., Awaitable],
+        *args,
+        classify: Callable[[Exception], Optional[str]] = lambda e: None
+    ):
+        """Run an SDK call under the same window and retry policy.
+        
+        `classify` maps an exception to "throttled", "retry" or None (fatal),
+        for clients like GA4's gRPC API that don't expose HTTP responses.
+        """
+        for attempt in range(self.max_retries + 1):
+            epoch = await self._acquire()
+            error = None
+            try:
+                result = await fn(*args)
+            except Exception as e:
+                error = e
+            finally:
+                await self._release()
+            
+            if error is None:
+                self._on_success()
+                return result
+            
+            kind = classify(error)
+            if kind is None or attempt == self.max_retries:
+                self.failures += 1
+                raise error
+            if kind == "throttled":
+                self._on_throttle(epoch, None)
+            else:
+                self.server_errors += 1
+            await self._sleep(self._backoff(attempt))
+    
+    def stats(self) -> Dict:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "requests": self.requests,
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "server_errors": self.server_errors,
+            "transport_errors": self.transport_errors,
+            "retries": self.retries,
+            "failures": self.failures,
+            "backoff_seconds": round(self.backoff_seconds, 1),
+            "last_retry_after": self.last_retry_after,
+            "last_throttled_at": self.last_throttled_at.isoformat() if self.last_throttled_at else None
+        }
+
+_limiters: Dict[str, SourceLimiter] = {}
+
+def get_limiter(source: str) -> SourceLimiter:
+    """Shared limiter for a source, so all of its syncs and backfill shards adapt together"""
+    if source not in _limiters:
+        _limiters[source] = SourceLimiter(source)
+    return _limiters[source]
+
+def throttle_stats() -> Dict[str, Dict]:
+    return {source: limiter.stats() for source, limiter in _limiters.items()}
\ No newline at end of file
@@ -0,0 +1,83 @@
+import importlib
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+# source -> (module, client class, SourceConfig fields passed to the constructor)
+CONNECTORS: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {
+    "mixpanel": ("integrations.mixpanel", "MixpanelClient", ("api_key", "api_secret")),
+    "amplitude": ("integrations.amplitude", "AmplitudeClient", ("api_key", "api_secret")),
+    "posthog": ("integrations.posthog", "PostHogClient", ("api_key", "project_id")),
+    "heap": ("integrations.heap", "HeapClient", ("api_key",)),
+    "ga4": ("integrations.ga4", "GA4Client", ("api_key", "project_id")),
+}
+
+class ConnectorRegistry:
+    """Resolve connector clients by source name, importing each module on first use.
+    
+    Connector modules (GA4 in particular pulls in the whole Google API stack)
+    are only imported when a source actually syncs, and client instances are
+    cached per source and credentials.
+    """
+    
+    def __init__(self, connectors: Dict[str, Tuple[str, str, Tuple[str, ...]]] = CONNECTORS, max_instances: int = 64):
+        self._connectors = dict(connectors)
+        self._classes: Dict[str, type] = {}
+        self._instances: "OrderedDict[tuple, object]" = OrderedDict()
+        self.max_instances = max_instances
+        self.import_seconds: Dict[str, float] = {}
+        self.instance_hits = 0
+        self.instance_misses = 0
+    
+    def __contains__(self, source: str) -> bool:
+        return source in self._connectors
+    
+    def register(self, source: str, module: str, class_name: str, fields: Tuple[str, ...]):
+        self._connectors[source] = (module, class_name, fields)
+        self._classes.pop(source, None)
+    
+    def sources(self):
+        return list(self._connectors)
+    
+    def _load_class(self, source: str) -> type:
+        if source not in self._classes:
+            module_name, class_name, _ = self._connectors[source]
+            started = time.perf_counter()
+            module = importlib.import_module(module_name)
+            self.import_seconds[source] = round(time.perf_counter() - started, 4)
+            self._classes[source] = getattr(module, class_name)
+        return self._classes[source]
+    
+    def get(self, config):
+        """Return a (cached) client for a SourceConfig"""
+        if config.source not in self._connectors:
+            raise ValueError(f"Unknown source: {config.source}")
+        
+        _, _, fields = self._connectors[config.source]
+        args = tuple(getattr(config, field) for field in fields)
+        key = (config.source, args)
+        
+        client = self._instances.get(key)
+        if client is not None:
+            self.instance_hits += 1
+            self._instances.move_to_end(key)
+            return client
+        
+        self.instance_misses += 1
+        client = self._load_class(config.source)(*args)
+        self._instances[key] = client
+        if len(self._instances) > self.max_instances:
+            self._instances.popitem(last=False)
+        return client
+    
+    def stats(self) -> Dict:
+        return {
+            "sources": self.sources(),
+            "loaded": sorted(self._classes),
+            "import_seconds": dict(self.import_seconds),
+            "cached_clients": len(self._instances),
+            "instance_hits": self.instance_hits,
+            "instance_misses": self.instance_misses
+        }
+
+connector_registry = ConnectorRegistry()
\ No newline at end of file
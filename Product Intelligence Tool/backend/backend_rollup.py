@@ -0,0 +1,97 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+ROLLUP_TABLE = "user_daily_activity"
+ROLLUP_COLUMNS = "day, user_id, event_name_id, event_count, first_seen, last_seen"
+# Sync state row holding the compaction watermark and last run stats
+COMPACTION_STATE = "compaction"
+
+# Fold new activity into existing rows; counts add up, first/last seen widen
+_MERGE = (
+    "ON CONFLICT (day, user_id, event_name_id) DO UPDATE SET "
+    "event_count = r.event_count + EXCLUDED.event_count, "
+    "first_seen = LEAST(r.first_seen, EXCLUDED.first_seen), "
+    "last_seen = GREATEST(r.last_seen, EXCLUDED.last_seen)"
+)
+
+def rollup_upsert_sql(source: str) -> str:
+    """INSERT rolling up the (user_id, event_name_id, timestamp) rows of `source`.
+    
+    `source` is usually the RETURNING of the events insert in a CTE, so only
+    rows that were really inserted (not dedup-skipped) are counted, in the
+    same transaction as the events themselves. Rows are upserted in key order
+    so concurrent writers lock them in the same order.
+    """
+    return (
+        f"INSERT INTO {ROLLUP_TABLE} AS r ({ROLLUP_COLUMNS}) "
+        f"SELECT CAST(timestamp AS date), user_id, event_name_id, count(*), min(timestamp), max(timestamp) "
+        f"FROM {source} GROUP BY 1, 2, 3 ORDER BY 1, 2, 3 "
+        f"{_MERGE}"
+    )
+
+async def rollup_rows(conn: AsyncConnection, rows: Iterable[Tuple[int, int, datetime]]):
+    """Fold inserted (user_id, event_name_id, timestamp) rows into the rollup, for drivers without COPY"""
+    groups: Dict[tuple, list] = {}
+    for user_id, event_name_id, ts in rows:
+        key = (ts.date(), user_id, event_name_id)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [1, ts, ts]
+        else:
+            group[0] += 1
+            group[1] = min(group[1], ts)
+            group[2] = max(group[2], ts)
+    if not groups:
+        return
+    
+    await conn.execute(
+        text(
+            f"INSERT INTO {ROLLUP_TABLE} AS r ({ROLLUP_COLUMNS}) "
+            f"VALUES (:day, :user_id, :event_name_id, :event_count, :first_seen, :last_seen) {_MERGE}"
+        ),
+        [
+            {
+                "day": day, "user_id": user_id, "event_name_id": event_name_id,
+                "event_count": count, "first_seen": first, "last_seen": last
+            }
+            for (day, user_id, event_name_id), (count, first, last) in sorted(groups.items())
+        ]
+    )
+
+async def rebuild_rollup(conn: AsyncConnection, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """Recompute rollup rows for days start..end (exclusive; everything when omitted) from events"""
+    day_filter, day_params = [], {}
+    events_filter, events_params = [], {}
+    if start is not None:
+        day_filter.append("day >= :start")
+        day_params["start"] = start
+        events_filter.append("timestamp >= :start")
+        events_params["start"] = datetime.combine(start, datetime.min.time())
+    if end is not None:
+        day_filter.append("day < :end")
+        day_params["end"] = end
+        events_filter.append("timestamp < :end")
+        events_params["end"] = datetime.combine(end, datetime.min.time())
+    day_where = f"WHERE {' AND '.join(day_filter)}" if day_filter else ""
+    events_where = f"WHERE {' AND '.join(events_filter)}" if events_filter else ""
+    
+    await conn.execute(text(f"DELETE FROM {ROLLUP_TABLE} {day_where}"), day_params)
+    result = await conn.execute(text(
+        f"INSERT INTO {ROLLUP_TABLE} AS r ({ROLLUP_COLUMNS}) "
+        f"SELECT CAST(timestamp AS date), user_id, event_name_id, count(*), min(timestamp), max(timestamp) "
+        f"FROM events {events_where} GROUP BY 1, 2, 3 "
+        f"ON CONFLICT (day, user_id, event_name_id) DO UPDATE SET "
+        f"event_count = EXCLUDED.event_count, first_seen = EXCLUDED.first_seen, last_seen = EXCLUDED.last_seen"
+    ), events_params)
+    return result.rowcount
+
+async def rolled_up_through(conn: AsyncConnection) -> Optional[date]:
+    """Compaction watermark: raw events before this day are rolled up and may be pruned"""
+    value = await conn.scalar(
+        text("SELECT metadata ->> 'rolled_up_through' FROM sync_state WHERE source = :source"),
+        {"source": COMPACTION_STATE}
+    )
+    return date.fromisoformat(value) if value else None
\ No newline at end of file
@@ -0,0 +1,131 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from pydantic import BaseModel
+from typing import Optional, List
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import asyncio
+import os
+import time
+
+from database import AsyncSessionLocal, SyncState
+from writer import BulkEventWriter, event_batches
+from integrations.registry import connector_registry
+
+# Max number of sources synced at the same time across all requests
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
+sync_semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+class IngestionTracker:
+    """Counts syncs and backfill shards in progress, so maintenance work can yield to them"""
+    
+    def __init__(self):
+        self.in_flight = 0
+    
+    @contextmanager
+    def track(self):
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+ingestion_tracker = IngestionTracker()
+
+class SourceConfig(BaseModel):
+    source: str
+    api_key: Optional[str] = None
+    api_secret: Optional[str] = None
+    project_id: Optional[str] = None
+    workspace_id: Optional[str] = None
+    lookback_days: int = 7
+
+async def ingest_from_source(config: SourceConfig, db: AsyncSession, progress=None):
+    sync_state = None
+    try:
+        if config.source not in connector_registry:
+            return {"error": f"Unknown source: {config.source}"}
+        client = connector_registry.get(config)
+        
+        # Get last sync
+        result = await db.execute(select(SyncState).where(SyncState.source == config.source))
+        sync_state = result.scalar_one_or_none()
+        
+        if sync_state and sync_state.last_sync:
+            start_date = sync_state.last_sync
+        else:
+            start_date = datetime.utcnow() - timedelta(days=config.lookback_days)
+        
+        end_date = datetime.utcnow()
+        if progress:
+            progress.start(start_date, end_date)
+        
+        # Fetch, normalize and bulk insert in chunks
+        writer = BulkEventWriter(db, config.source, progress=progress)
+        await writer.consume(event_batches(client, start_date, end_date))
+        stats = await writer.close()
+        
+        # Update sync state
+        if sync_state:
+            sync_state.last_sync = end_date
+            sync_state.status = "success"
+        else:
+            sync_state = SyncState(
+                source=config.source,
+                last_sync=end_date,
+                status="success"
+            )
+            db.add(sync_state)
+        
+        await db.commit()
+        return {
+            "status": "success",
+            "events_ingested": stats["rows"],
+            "events_skipped": stats["skipped"],
+            "events_rejected": stats["rejected"],
+            "rows_per_sec": stats["rows_per_sec"]
+        }
+    
+    except Exception as e:
+        # A failed COPY aborts the transaction, so roll back before recording the error
+        await db.rollback()
+        if sync_state:
+            # Keep backfill checkpoints when recording the error
+            await db.refresh(sync_state)
+            sync_state.status = "error"
+            sync_state.metadata = {**(sync_state.metadata or {}), "error": str(e)}
+            await db.commit()
+        return {"status": "error", "message": str(e)}
+
+async def sync_one(config: SourceConfig, progress=None):
+    """Sync a single source on its own session, bounded by the global cap"""
+    with ingestion_tracker.track():
+        async with sync_semaphore:
+            started = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                result = await ingest_from_source(config, db, progress)
+            if progress:
+                progress.finish(result)
+            return {
+                "source": config.source,
+                "result": result,
+                "duration_seconds": round(time.monotonic() - started, 3)
+            }
+
+async def sync_concurrently(configs: List[SourceConfig], progresses: Optional[List] = None):
+    """Run all sources concurrently and yield each result as it finishes.
+    
+    Closing or cancelling the iteration cancels every source still running.
+    """
+    progresses = progresses or [None] * len(configs)
+    tasks = [
+        asyncio.create_task(sync_one(config, progress))
+        for config, progress in zip(configs, progresses)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sync import SourceConfig, sync_concurrently
+from backfill import run_backfill
+from batch import EventBatch
+
+MAX_TRACKED_JOBS = 100
+
+class SourceProgress:
+    """Live progress of one source inside a sync job"""
+    
+    def __init__(self, source: str):
+        self.source = source
+        self.status = "queued"
+        self.pages = 0
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.window_start: Optional[datetime] = None
+        self.window_end: Optional[datetime] = None
+        self.latest_event: Optional[datetime] = None
+        self.result: Optional[Dict] = None
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+    
+    def start(self, window_start: datetime, window_end: datetime):
+        self.status = "running"
+        self.window_start = window_start
+        self.window_end = window_end
+        self._started = time.monotonic()
+    
+    def record_page(self, batch: EventBatch):
+        self.pages += 1
+        latest = batch.latest_timestamp()
+        if latest is not None and (self.latest_event is None or latest > self.latest_event):
+            self.latest_event = latest
+    
+    def record_rows(self, written: int, skipped: int):
+        self.rows_written += written
+        self.rows_skipped += skipped
+    
+    def finish(self, result: Dict):
+        self.result = result
+        self.status = result.get("status", "error")
+        self._finished = time.monotonic()
+    
+    def cancel(self):
+        if self.status in ("queued", "running"):
+            self.status = "cancelled"
+            self._finished = time.monotonic()
+    
+    def _elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.monotonic()) - self._started
+    
+    def _fraction_done(self) -> Optional[float]:
+        """Share of the sync window covered so far, judged by the newest event seen"""
+        if self.status != "running" or not (self.window_start and self.window_end and self.latest_event):
+            return None
+        window = (self.window_end - self.window_start).total_seconds()
+        if window <= 0:
+            return None
+        covered = (self.latest_event - self.window_start).total_seconds()
+        return min(max(covered / window, 0.0), 1.0)
+    
+    def to_dict(self) -> Dict:
+        elapsed = self._elapsed()
+        fraction = self._fraction_done()
+        eta = None
+        if fraction:
+            eta = round(elapsed * (1 - fraction) / fraction, 1)
+        
+        return {
+            "source": self.source,
+            "status": self.status,
+            "pages_fetched": self.pages,
+            "rows_written": self.rows_written,
+            "rows_skipped": self.rows_skipped,
+            "rows_per_sec": round((self.rows_written + self.rows_skipped) / elapsed, 1) if elapsed > 0 else 0.0,
+            "elapsed_seconds": round(elapsed, 1),
+            "progress": round(fraction, 3) if fraction is not None else None,
+            "eta_seconds": eta,
+            "result": self.result
+        }
+
+class SyncJob:
+    def __init__(self, configs: List[SourceConfig], kind: str = "sync"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.configs = configs
+        self.status = "queued"
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.sources = [SourceProgress(config.source) for config in configs]
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+    
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "sources": [progress.to_dict() for progress in self.sources]
+        }
+
+class SyncJobManager:
+    """Runs sync jobs as background tasks and keeps the most recent ones for status queries"""
+    
+    def __init__(self, max_jobs: int = MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+    
+    def submit(self, configs: List[SourceConfig]) -> SyncJob:
+        job = SyncJob(configs)
+        return self._start(job, lambda: self._sync(job))
+    
+    def submit_backfill(
+        self,
+        config: SourceConfig,
+        client,
+        start_date: datetime,
+        end_date: datetime,
+        **options
+    ) -> SyncJob:
+        """Run a backfill (see backfill.run_backfill) as a job; its stats become the source's result"""
+        job = SyncJob([config], kind="backfill")
+        return self._start(job, lambda: self._backfill(job, client, start_date, end_date, **options))
+    
+    def _start(self, job: SyncJob, work: Callable[[], Awaitable]) -> SyncJob:
+        self._jobs[job.id] = job
+        self._evict()
+        job.task = asyncio.create_task(self._run(job, work))
+        return job
+    
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        return self._jobs.get(job_id)
+    
+    def list(self) -> List[SyncJob]:
+        return list(reversed(self._jobs.values()))
+    
+    def cancel(self, job_id: str) -> Optional[SyncJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+        return job
+    
+    async def shutdown(self):
+        running = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+    
+    async def _sync(self, job: SyncJob):
+        async for _ in sync_concurrently(job.configs, job.sources):
+            pass
+    
+    async def _backfill(self, job: SyncJob, client, start_date: datetime, end_date: datetime, **options):
+        progress = job.sources[0]
+        progress.start(start_date, end_date)
+        progress.finish(await run_backfill(client, progress.source, start_date, end_date, **options))
+    
+    async def _run(self, job: SyncJob, work: Callable[[], Awaitable]):
+        job.status = "running"
+        try:
+            await work()
+            failed = any(progress.status != "success" for progress in job.sources)
+            job.status = "failed" if failed else "completed"
+        except asyncio.CancelledError:
+            for progress in job.sources:
+                progress.cancel()
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"Sync job {job.id} error: {e}")
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.utcnow()
+    
+    def _evict(self):
+        """Drop the oldest finished jobs beyond max_jobs"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+sync_jobs = SyncJobManager()
\ No newline at end of file
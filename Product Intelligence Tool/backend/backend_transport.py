@@ -0,0 +1,94 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+import httpx
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_PER_HOST_CONNECTIONS = int(os.getenv("HTTP_PER_HOST_CONNECTIONS", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that frees its host slot once the body is closed"""
+    
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+    
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+    
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self._semaphore.release()
+        await self._stream.aclose()
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Pooled transport that caps in-flight requests per host"""
+    
+    def __init__(self, transport: httpx.AsyncBaseTransport, per_host: int):
+        self._transport = transport
+        self._per_host = per_host
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self._per_host)
+        semaphore = self._semaphores[host]
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        response.stream = _ReleasingStream(response.stream, semaphore)
+        return response
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+_client: Optional[httpx.AsyncClient] = None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the keep-alive connection pool shared by connectors and LLM providers"""
+    http2 = HTTP2_ENABLED and _http2_available()
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    transport = HostLimitedTransport(
+        httpx.AsyncHTTPTransport(limits=limits, http2=http2, retries=1),
+        per_host=HTTP_PER_HOST_CONNECTIONS
+    )
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use outside the app lifespan"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+async def init_http_client():
+    get_http_client()
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
\ No newline at end of file
@@ -0,0 +1,270 @@
+import json
+import time
+from datetime import datetime
+from itertools import repeat
+from typing import AsyncIterator, Dict, Iterable, Tuple, Union
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from batch import WEIGHT_PROPERTIES, EventBatch, event_dedup_key, identity_json, naive_utc
+from database import Event, engine as db_engine
+import dimensions
+from partitions import create_partitions, partition_starts, timestamp_window
+from properties import PROMOTED_PROPERTIES, extract_promoted
+from rollup import rolled_up_through, rollup_rows, rollup_upsert_sql
+
+PROMOTED_COLUMNS = [prop.column for prop in PROMOTED_PROPERTIES.values()]
+COPY_COLUMNS = ["user_id", "session_id", "event_name_id", "timestamp", "source_id", "properties", "created_at", "dedup_key"] + PROMOTED_COLUMNS
+STAGING_TABLE = "events_staging"
+
+# Columns of a prepared batch, as built by prepare_batch
+PREPARED_COLUMNS = ("user_id", "session_id", "event_name", "timestamp", "properties", "properties_json", "created_at", "dedup_key") + tuple(PROMOTED_COLUMNS)
+
+def prepare_batch(source: str, batch: EventBatch, created_at: datetime) -> Dict[str, list]:
+    """Add the derived columns (naive UTC timestamps, properties JSON, dedup keys, promoted properties) to a batch"""
+    timestamps = [naive_utc(ts) for ts in batch.timestamp]
+    properties_json = [json.dumps(p, sort_keys=True, default=str) for p in batch.properties]
+    return {
+        **extract_promoted(batch.properties),
+        "user_id": batch.user_id,
+        "session_id": batch.session_id,
+        "event_name": batch.event_name,
+        "timestamp": timestamps,
+        "properties": batch.properties,
+        "properties_json": properties_json,
+        "created_at": [created_at] * len(batch),
+        "dedup_key": [
+            event_dedup_key(source, user_id, event_name, ts, identity_json(source, p, pj, session_id))
+            for user_id, session_id, event_name, ts, p, pj in zip(
+                batch.user_id, batch.session_id, batch.event_name, timestamps, batch.properties, properties_json
+            )
+        ]
+    }
+
+async def event_batches(client, start_date: datetime, end_date: datetime) -> AsyncIterator[EventBatch]:
+    """Yield normalized event batches from a connector, streaming when it supports it"""
+    if hasattr(client, "stream_events"):
+        async for batch in client.stream_events(start_date, end_date):
+            yield batch
+    else:
+        events = await client.fetch_events(start_date, end_date)
+        if events:
+            yield EventBatch.from_events(events)
+
+class BulkEventWriter:
+    """Stream normalized events into the events table in fixed-size chunks.
+    
+    Batches are buffered column-wise up to `chunk_size` rows and then written
+    with asyncpg COPY (or an executemany of a Core insert on other drivers),
+    so memory stays flat no matter how many events a sync produces. Every
+    row carries a dedup key and rows already present are skipped server-side
+    with ON CONFLICT DO NOTHING. User ids, event names and the source are
+    swapped for their dimension keys chunk by chunk, and the rows actually
+    inserted are folded into the user_daily_activity rollup. The caller owns
+    the transaction and commits once the writer is closed.
+    """
+    
+    def __init__(self, db: AsyncSession, source: str, chunk_size: int = 5000, progress=None):
+        self.db = db
+        self.source = source
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.rows_rejected = 0
+        self.chunks_written = 0
+        self._staging_ready = False
+        self._window = None
+        self._source_id = None
+        self._buffer: Dict[str, list] = {column: [] for column in PREPARED_COLUMNS}
+        self._started_at = None
+        self._elapsed = 0.0
+    
+    async def write(self, events: Union[EventBatch, Iterable[Dict]]):
+        """Buffer a batch (or normalized event dicts) and flush every `chunk_size` rows"""
+        if not isinstance(events, EventBatch):
+            events = EventBatch.from_events(events)
+        await self.write_prepared(prepare_batch(self.source, events, datetime.utcnow()))
+    
+    async def write_prepared(self, columns: Dict[str, list]):
+        """Buffer columns already built by prepare_batch, e.g. in a worker process"""
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        
+        for column in PREPARED_COLUMNS:
+            self._buffer[column].extend(columns[column])
+        while len(self._buffer["dedup_key"]) >= self.chunk_size:
+            await self._flush_chunk()
+    
+    async def consume(self, batches: AsyncIterator[EventBatch]):
+        """Write batches from a connector's stream_events as they arrive"""
+        async for batch in batches:
+            if self.progress:
+                self.progress.record_page(batch)
+            await self.write(batch)
+    
+    async def flush(self):
+        """Write everything buffered to the database"""
+        while self._buffer["dedup_key"]:
+            await self._flush_chunk()
+    
+    async def _flush_chunk(self):
+        chunk = {}
+        for column in PREPARED_COLUMNS:
+            chunk[column] = self._buffer[column][:self.chunk_size]
+            del self._buffer[column][:self.chunk_size]
+        if self._window is None:
+            self._window = await self._accepted_window()
+        chunk = self._reject_out_of_window(chunk)
+        count = len(chunk["dedup_key"])
+        if not count:
+            return
+        
+        # Swap dimension strings for their integer keys
+        if self._source_id is None:
+            self._source_id = (await dimensions.sources.resolve([self.source]))[self.source]
+        user_keys = await dimensions.users.resolve(chunk["user_id"])
+        event_name_keys = await dimensions.event_names.resolve(chunk["event_name"])
+        chunk["user_id"] = [user_keys[u] for u in chunk["user_id"]]
+        chunk["event_name"] = [event_name_keys[n] for n in chunk["event_name"]]
+        
+        connection = await self.db.connection()
+        await create_partitions(db_engine, connection, partition_starts(ts for ts in chunk["timestamp"] if ts is not None))
+        
+        weights = WEIGHT_PROPERTIES.get(self.source, ())
+        weighted = any(key in p for p in chunk["properties"] for key in weights)
+        if connection.dialect.driver == "asyncpg":
+            inserted = await self._copy(await connection.get_raw_connection(), chunk, weighted)
+        else:
+            result = await self.db.execute(
+                insert(Event)
+                .on_conflict_do_nothing(index_elements=["dedup_key", "timestamp"])
+                .returning(Event.user_id, Event.event_name_id, Event.timestamp),
+                [
+                    dict(zip(COPY_COLUMNS, record))
+                    for record in self._records(chunk, properties="properties")
+                ]
+            )
+            rows = result.all()
+            await rollup_rows(connection, rows)
+            inserted = len(rows)
+            if weighted:
+                await self._update_weights(connection, chunk)
+        
+        self.rows_written += inserted
+        self.rows_skipped += count - inserted
+        self.chunks_written += 1
+        if self.progress:
+            self.progress.record_rows(inserted, count - inserted)
+    
+    async def _accepted_window(self) -> Tuple[datetime, datetime]:
+        """partitions.timestamp_window, starting no earlier than the compaction watermark.
+        
+        Raw events before the watermark are already in the rollup and may have
+        been pruned along with their dedup keys, so writing them again (a
+        backfill, a lookback sync) would count them twice.
+        """
+        earliest, latest = timestamp_window()
+        watermark = await rolled_up_through(await self.db.connection())
+        if watermark is not None:
+            earliest = max(earliest, datetime.combine(watermark, datetime.min.time()))
+        return earliest, latest
+    
+    def _reject_out_of_window(self, chunk: Dict[str, list]) -> Dict[str, list]:
+        """Drop rows whose timestamp falls outside the accepted window"""
+        earliest, latest = self._window
+        keep = [i for i, ts in enumerate(chunk["timestamp"]) if ts is None or earliest <= ts < latest]
+        rejected = len(chunk["timestamp"]) - len(keep)
+        if not rejected:
+            return chunk
+        self.rows_rejected += rejected
+        print(f"Rejected {rejected} {self.source} events with timestamps outside {earliest:%Y-%m-%d}..{latest:%Y-%m-%d}")
+        return {column: [values[i] for i in keep] for column, values in chunk.items()}
+    
+    def _records(self, chunk: Dict[str, list], properties: str = "properties_json"):
+        """Row tuples in COPY_COLUMNS order, zipped straight from the columns"""
+        return zip(
+            chunk["user_id"],
+            chunk["session_id"],
+            chunk["event_name"],
+            chunk["timestamp"],
+            repeat(self._source_id),
+            chunk[properties],
+            chunk["created_at"],
+            chunk["dedup_key"],
+            *[chunk[column] for column in PROMOTED_COLUMNS]
+        )
+    
+    async def _update_weights(self, connection, chunk: Dict[str, list]):
+        """Overwrite the properties of stored rows whose weight changed, for drivers without COPY"""
+        table = Event.__table__
+        columns = ["dedup_key", "timestamp", "properties"] + PROMOTED_COLUMNS
+        await connection.execute(
+            update(table)
+            .where(table.c.dedup_key == bindparam("b_dedup_key"), table.c.timestamp == bindparam("b_timestamp"))
+            .where(table.c.properties.is_distinct_from(bindparam("b_properties", type_=table.c.properties.type)))
+            .values({column: bindparam(f"b_{column}") for column in ["properties"] + PROMOTED_COLUMNS}),
+            [dict(zip([f"b_{column}" for column in columns], row)) for row in zip(*[chunk[column] for column in columns])]
+        )
+    
+    async def _copy(self, raw, chunk: Dict[str, list], weighted: bool = False) -> int:
+        """COPY a chunk into a temp staging table, then move new rows into events and the rollup"""
+        driver = raw.driver_connection
+        columns = ", ".join(COPY_COLUMNS)
+        if not self._staging_ready:
+            await driver.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ON COMMIT DELETE ROWS "
+                f"AS SELECT {columns} FROM {Event.__tablename__} WITH NO DATA"
+            )
+            self._staging_ready = True
+        
+        await driver.copy_records_to_table(
+            STAGING_TABLE,
+            records=self._records(chunk),
+            columns=COPY_COLUMNS
+        )
+        
+        inserted = await driver.fetchval(
+            f"WITH inserted AS ("
+            f"INSERT INTO {Event.__tablename__} ({columns}) "
+            f"SELECT {columns} FROM {STAGING_TABLE} "
+            f"ON CONFLICT (dedup_key, timestamp) DO NOTHING "
+            f"RETURNING user_id, event_name_id, timestamp"
+            f"), rolled_up AS ({rollup_upsert_sql('inserted')}) "
+            f"SELECT count(*) FROM inserted"
+        )
+        if weighted:
+            # Rows that were already stored keep their place; only their weight changes
+            assignments = ", ".join(f"{column} = s.{column}" for column in ["properties"] + PROMOTED_COLUMNS)
+            await driver.execute(
+                f"UPDATE {Event.__tablename__} e SET {assignments} FROM {STAGING_TABLE} s "
+                f"WHERE e.dedup_key = s.dedup_key AND e.timestamp = s.timestamp "
+                f"AND e.properties IS DISTINCT FROM s.properties"
+            )
+        await driver.execute(f"TRUNCATE {STAGING_TABLE}")
+        return inserted
+    
+    async def close(self) -> Dict:
+        """Flush any remaining rows and return throughput stats"""
+        await self.flush()
+        if self._started_at is not None:
+            self._elapsed = time.monotonic() - self._started_at
+        return self.stats()
+    
+    @property
+    def rows_per_sec(self) -> float:
+        if self._elapsed <= 0:
+            return 0.0
+        return (self.rows_written + self.rows_skipped) / self._elapsed
+    
+    def stats(self) -> Dict:
+        return {
+            "rows": self.rows_written,
+            "skipped": self.rows_skipped,
+            "rejected": self.rows_rejected,
+            "chunks": self.chunks_written,
+            "seconds": round(self._elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1)
+        }
\ No newline at end of file
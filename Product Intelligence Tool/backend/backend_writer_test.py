@@ -0,0 +1,41 @@
+"""BulkEventWriter against a live Postgres; see init_db_test for TEST_DATABASE_URL"""
+import unittest
+from datetime import datetime, timedelta
+
+from database import init_db
+from init_db_test import DatabaseTestCase
+
+def _counted(day: datetime, event_count: int) -> list:
+    return [{
+        "user_id": "user-1",
+        "session_id": "session-1",
+        "event_name": "page_view",
+        "timestamp": day + timedelta(hours=1),
+        "properties": {"event_count": event_count}
+    }]
+
+class WeightedEventsTest(DatabaseTestCase):
+    
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await init_db()
+    
+    async def test_ga4_resync_updates_event_count_in_place(self):
+        await self._write("ga4", _counted(self.day, 3))
+        stats = await self._write("ga4", _counted(self.day, 5))
+        
+        self.assertEqual((stats["rows"], stats["skipped"]), (0, 1))
+        self.assertEqual(await self._scalar("SELECT properties ->> 'event_count' FROM events"), "5")
+    
+    async def test_other_sources_dedup_on_full_properties(self):
+        # event_count is only a weight for GA4; elsewhere it's an ordinary property
+        await self._write("mixpanel", _counted(self.day, 3))
+        stats = await self._write("mixpanel", _counted(self.day, 5))
+        
+        self.assertEqual(stats["rows"], 1)
+        self.assertEqual(await self._scalar("SELECT count(*) FROM events"), 2)
+        stats = await self._write("mixpanel", _counted(self.day, 5))
+        self.assertEqual((stats["rows"], stats["skipped"]), (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
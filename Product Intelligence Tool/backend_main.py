@@ -1,20 +1,28 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from database import init_db
+from transport import init_http_client, close_http_client
+from event_queue import event_queue
+from sync_jobs import sync_jobs
 from routers import ingestion, metrics, insights, query
-from jobs import metric_computation_job, detection_job
+from jobs import scheduler, metric_computation_job, detection_job, partition_maintenance_job, promoted_backfill_job, compaction_job, schedule_source_syncs
 
-scheduler = AsyncIOScheduler()
+startup_timings = {"import_seconds": round(time.perf_counter() - _import_started, 4)}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    started = time.perf_counter()
     await init_db()
+    await init_http_client()
+    await event_queue.start()
     scheduler.add_job(
         metric_computation_job,
         IntervalTrigger(hours=1),
@@ -27,10 +35,33 @@ async def lifespan(app: FastAPI):
         id="detect_anomalies",
         replace_existing=True
     )
+    scheduler.add_job(
+        partition_maintenance_job,
+        IntervalTrigger(hours=24),
+        id="partition_maintenance",
+        replace_existing=True
+    )
+    # No trigger: runs once, right after startup
+    scheduler.add_job(
+        promoted_backfill_job,
+        id="backfill_promoted",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        compaction_job,
+        IntervalTrigger(hours=24),
+        id="compact_events",
+        replace_existing=True
+    )
+    await schedule_source_syncs()
     scheduler.start()
+    startup_timings["lifespan_seconds"] = round(time.perf_counter() - started, 4)
     yield
     # Shutdown
     scheduler.shutdown()
+    await sync_jobs.shutdown()
+    await event_queue.stop()
+    await close_http_client()
 
 app = FastAPI(title="CXM Product Intelligence", lifespan=lifespan)
 
@@ -53,7 +84,7 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", "startup": startup_timings}
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file